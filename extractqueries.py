@@ -1,95 +1,211 @@
 import argparse
+import concurrent.futures
 import csv
-import ctypes
-import gzip
+import io
 import json
+import locale
 import multiprocessing
-import multiprocessing.sharedctypes
 import multiprocessing.synchronize
+import os
 import pathlib
-import queue
+import shutil
 import signal
 import sys
 import time
+import traceback
 import typing
 
+try:
+    # ISA-L's drop-in replacement for gzip decompresses considerably faster.
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 import sqlextractor
 
 
+OUTPUT_ENCODING: str = locale.getpreferredencoding(False)
+"""The encoding that the output CSV file is written in"""
+
+
 class SignalHandler:
     """Handle signals gracefully"""
-    def __init__(self) -> None:
+    def __init__(self, stop_event: multiprocessing.synchronize.Event) -> None:
         signal.signal(signal.SIGINT, self.request_stop)
         signal.signal(signal.SIGTERM, self.request_stop)
         self.stop_requested: bool = False
         """Whether the OS has requested that we stop."""
+        self.stop_event: multiprocessing.synchronize.Event = stop_event
+        """Set when a stop is requested, to tell the workers to stop as well."""
 
     def request_stop(self, signum, frame) -> None:
         self.stop_requested = True
+        self.stop_event.set()
 
 
-def worker_process(file_queue: multiprocessing.Queue, 
-                   files_completed: multiprocessing.sharedctypes.Synchronized,
-                   sql_query_queue: multiprocessing.Queue,
-                   exception_thrown: multiprocessing.synchronize.Event) -> None:
+worker_stop_event: typing.Optional[multiprocessing.synchronize.Event] = None
+"""In a worker process, set when the main process wants the workers to stop"""
+
+
+def init_worker(stop_event: multiprocessing.synchronize.Event) -> None:
     """
-    A single process that will be parallelized. Given a Queue of file names, this will
-    process in parallel. Controller by the main thread.
-
-    :param file_queue: A queue to store the names of the input files
-    :param files_completed: A multiprocessing.Value object storing the number of
-    processes completed.
-    :param sql_query_queue: A queue to store the output SQL queries to be passed back
-    to the main thread.
-    :param exception_thrown: Whether an exception has been thrown.
+    Sets up a worker process.
+
+    :param stop_event: Set when the main process wants the workers to stop
+    """
+    global worker_stop_event
+    worker_stop_event = stop_event
+    # The main process tells us when to stop, so that we don't get killed
+    # halfway through writing a row when Ctrl+C is pressed.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def parse_json_line(json_line: bytes) -> dict:
+    """
+    Parses a single line of BigQuery data.
+
+    Uses `orjson` if it is installed, since it is much faster than the
+    `json` module. `orjson` refuses strings containing lone surrogates,
+    which show up in some file contents, so those lines are handed to the
+    `json` module instead.
+
+    :param json_line: The raw line of JSON, as read from the file
     """
-    while True:
+    if orjson is not None:
         try:
-            input_file: pathlib.Path = file_queue.get(timeout=1/65536)
-
-            # Read the file in line by line
-            with gzip.open(str(input_file), mode="r") as json_file:
-                for json_line in json_file:
-                    # The JSON should contain "repo_name", "path", and
-                    # "content"
-                    bigquery_result: dict = json.loads(json_line)
-                    # print(bigquery_result["repo_name"], bigquery_result["path"])
-                    try:
-                        program_strings: list[str] = sqlextractor.extractor.extractor.Extractor.extract_bigquery(
-                            bigquery_result["repo_name"], 
-                            bigquery_result["path"],
-                            bigquery_result["content"]
-                        )
-                        #print(program_strings)
-                        sql_strings: list[str] = []
-                        for program_string in program_strings:
-                            # Strip the whitespace from the string.
-                            program_string = program_string.strip()
-                            if sqlextractor.parser.parser.check_valid_pglast_postgres(program_string):
-                                sql_strings.append(program_string)
-                        for sql_string in sql_strings:
-                            sql_query_queue.put((bigquery_result["repo_name"], bigquery_result["path"], sql_string))
-                    except sqlextractor.extractor.extractor.ParsingError:
-                        # Failed to parse the code. Hopefully this doesn't happen
-                        # too much.
-                        pass
-                    except ValueError as e:
-                        # Unrecognized file type. That's okay.
+            return orjson.loads(json_line)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(json_line)
+
+
+def csv_field(field: str) -> str:
+    """
+    Formats a single CSV field, quoting it the same way that `csv.writer`
+    does with the default dialect.
+
+    :param field: The value of the field
+    """
+    if '"' in field:
+        return '"' + field.replace('"', '""') + '"'
+    if "," in field or "\n" in field or "\r" in field:
+        return '"' + field + '"'
+    return field
+
+
+def read_json_lines(input_file: str, decompress_whole_file: bool) -> typing.Iterator[bytes]:
+    """
+    Reads the lines of a gzipped BigQuery file.
+
+    :param input_file: The BigQuery file to read
+    :param decompress_whole_file: If true, the whole file is read and
+    decompressed in one go, which is faster but needs enough memory to
+    hold the entire decompressed file. Otherwise, it is decompressed
+    a block at a time.
+    """
+    if decompress_whole_file:
+        with open(input_file, 'rb') as compressed_file:
+            json_data: bytes = gzip.decompress(compressed_file.read())
+        for json_line in json_data.split(b"\n"):
+            if json_line != b"":
+                yield json_line
+    else:
+        # Read the file in line by line
+        # Read ahead in large blocks; the default buffer is tiny.
+        with io.BufferedReader(gzip.open(input_file, mode="rb"),  # type: ignore[arg-type]
+                               buffer_size=1 << 20) as json_file:
+            yield from json_file
+
+
+def process_one_file(input_file: str, intermediate_dir: str, decompress_whole_file: bool) -> int:
+    """
+    Extracts the SQL queries from a single BigQuery file. Run in the worker
+    processes of a ProcessPoolExecutor.
+
+    The SQL queries found are appended to a CSV file of this worker's own
+    in the intermediate directory, to be combined by the main process
+    once all files have been processed.
+
+    :param input_file: The BigQuery file to process
+    :param intermediate_dir: The directory to write this worker's CSV file into.
+    :param decompress_whole_file: Whether to decompress the whole file in
+    memory at once. See `read_json_lines()`.
+    :return: The number of SQL queries found
+    """
+    rows_written: int = 0
+    if worker_stop_event is not None and worker_stop_event.is_set():
+        # Stopping, don't start on a new file
+        return rows_written
+    if not input_file.lower().endswith(".gz"):
+        # Not a BigQuery export
+        return rows_written
+    # Look these up once rather than for every line and candidate
+    extract_bigquery = sqlextractor.extractor.extractor.Extractor.extract_bigquery
+    check_valid_sql = sqlextractor.parser.parser.check_valid_pglast_postgres
+    shard_path: str = os.path.join(intermediate_dir, "worker_" + str(os.getpid()) + ".csv")
+    with open(shard_path, 'ab') as shard_file:
+        sql_query_rows: bytearray = bytearray()
+        """CSV rows of SQL queries that have not been written to the file yet"""
+        try:
+            for json_line in read_json_lines(input_file, decompress_whole_file):
+                if worker_stop_event is not None and worker_stop_event.is_set():
+                    # Stop early, leaving the rows written so far intact
+                    break
+                # The JSON should contain "repo_name", "path", and
+                # "content"
+                bigquery_result: dict = parse_json_line(json_line)
+                # print(bigquery_result["repo_name"], bigquery_result["path"])
+                try:
+                    repo_name: str = bigquery_result["repo_name"]
+                    file_path: str = bigquery_result["path"]
+                    program_strings: list[str] = extract_bigquery(
+                        repo_name, 
+                        file_path,
+                        bigquery_result["content"]
+                    )
+                    #print(program_strings)
+                    row_prefix: typing.Optional[str] = None
+                    """The CSV fields of the row that come before the query"""
+                    for sql_string in program_strings:
+                        # Strip the whitespace from the string.
+                        sql_string = sql_string.strip()
+                        if not check_valid_sql(sql_string):
+                            continue
+                        if row_prefix is None:
+                            row_prefix = csv_field(repo_name) + "," + csv_field(file_path) + ","
+                        try:
+                            sql_query_rows += (row_prefix + csv_field(sql_string) + "\r\n").encode(OUTPUT_ENCODING)
+                        except UnicodeEncodeError as e:
+                            # Some characters (usually foreign language characters in usernames or repo names) throw an error when trying to be written to file.
+                            print((repo_name, file_path, sql_string))
+                            print (e)
+                            continue
+                        rows_written += 1
+                        if len(sql_query_rows) >= 1 << 20:
+                            # Write the rows in one go
+                            shard_file.write(sql_query_rows)
+                            sql_query_rows.clear()
+                except sqlextractor.extractor.extractor.ParsingError:
+                    # Failed to parse the code. Hopefully this doesn't happen
+                    # too much.
+                    pass
+                except ValueError as e:
+                    # Unrecognized file type. That's okay.
+                    pass
+                except KeyError as e:
+                    if e.args[0] == "content":
+                        # No source associated with this file.
                         pass
-                    except KeyError as e:
-                        if e.args[0] == "content":
-                            # No source associated with this file.
-                            pass
-                        else:
-                            exception_thrown.set()
-                            raise e
-
-            # Increase the total number of files completed.
-            with files_completed.get_lock():
-                files_completed.value += 1
-        except queue.Empty:
-            # All files complete
-            break
+                    else:
+                        raise e
+        finally:
+            shard_file.write(sql_query_rows)
+    return rows_written
 
 
 def main(argv: list[str]) -> int:
@@ -101,6 +217,10 @@ def main(argv: list[str]) -> int:
     argparser.add_argument("--intermediate-dir", "-i", 
             default=pathlib.Path("extractqueries-temp"), type=pathlib.Path,
             help="Temporary directory to put intermediate products into")
+    argparser.add_argument("--decompress-whole-file", "-w", action="store_true",
+            help="Decompress each input file in memory all at once instead of " + 
+            "a block at a time. Faster, but each worker needs enough memory " + 
+            "to hold a whole decompressed input file.")
     argparser.add_argument("--process-count", "-p", default=2, type=int,
             help="Number of processes to start. For maximum efficiency, set this" + 
             " to the number of available CPU cores.")
@@ -122,101 +242,74 @@ def main(argv: list[str]) -> int:
         return 16
 
     # Write the header line of the file.
-    with open(parsedargs["output_file"], 'w') as outputcsvfile:
+    with open(parsedargs["output_file"], 'w', encoding=OUTPUT_ENCODING) as outputcsvfile:
         outputcsvwriter = csv.writer(outputcsvfile)
         outputcsvwriter.writerow(("repo", "file_path", "sql_query"))
 
-    # TODO Parallelize with the multiprocessing module. To do this, read
-    # in the list of all files, then distribute the tasks among each
-    # process.
-    input_file_queue: multiprocessing.Queue = multiprocessing.Queue()
-    """A queue to store the paths of all the input files"""
-
-    exception_thrown: multiprocessing.synchronize.Event = multiprocessing.Event()
-    """Whether an exception has been thrown in a worker."""
-
-    files_completed: multiprocessing.sharedctypes.Synchronized[ctypes.c_ulonglong] = multiprocessing.Value(ctypes.c_ulonglong, 0)  # type: ignore[assignment]
-    total_files: int = 0
-
-    for input_file in parsedargs["input_directory"].iterdir():
-        input_file_queue.put(input_file)
-        total_files += 1
+    # BigQuery exports are gzipped; skip anything else in the directory.
+    # Paths are passed to the workers as strings, which are much cheaper
+    # to pickle than pathlib.Path objects.
+    input_files: list[str] = [
+        os.fspath(input_file) for input_file in parsedargs["input_directory"].iterdir()
+        if input_file.suffix.lower() == ".gz" and input_file.is_file()
+    ]
+    total_files: int = len(input_files)
     
-    sql_query_queue: multiprocessing.Queue = multiprocessing.Queue()
-    """
-    A queue to store the completed SQL queries. Will be tuples of
-    (repo_name, repo_path, query)
-    """
+    intermediate_dir: pathlib.Path = parsedargs["intermediate_dir"]
+    intermediate_dir.mkdir(parents=True, exist_ok=True)
+    # Don't mix in queries left over from a previous run.
+    for shard_path in intermediate_dir.glob("worker_*.csv"):
+        shard_path.unlink()
 
-    worker_processes: list[multiprocessing.Process] = []
-    for _ in range(parsedargs["process_count"]):
-        worker_processes.append(multiprocessing.Process(target=worker_process,args=(
-            input_file_queue, files_completed, sql_query_queue, exception_thrown
-        )))
-
-    def consume_all_from_sql_query_queue() -> None:
-        """
-        Consume all entries from sql_query_queue to save memory and
-        prevent deadlocking.
-
-        This function will write the consumed queries to the output
-        CSV file.
-        """
-        with open(parsedargs["output_file"], 'a', newline="") as outputcsvfile:
-            outputcsvwriter = csv.writer(outputcsvfile)
-            while True:
-                try:
-                    sql_query_row = sql_query_queue.get(timeout=1/1048576)
-                    outputcsvwriter.writerow(sql_query_row)
-                except queue.Empty:
-                    break
-                except Exception as e:
-                    # Some characters (usually foreign language characters in usernames or repo names) throw an error when trying to be written to file.
-                    print(sql_query_row)
-                    print (e)
-    
-    # Start all the subprocesses
-    for process in worker_processes:
-        process.start()
-
-    last_progress_update_time: float = time.time()
-    """The last time we offered the user a progress update"""
-    signal_handler = SignalHandler()
-
-    while not signal_handler.stop_requested:
-        # Check if any processes are alive
-        all_processes_exited: bool = True
-        for process in worker_processes:
-            if process.is_alive():
-                all_processes_exited = False
-                break
-        if all_processes_exited:
-            # We should exit as well
-            break
-
-        if exception_thrown.is_set():
-            print("ERROR: A worker has thrown an exception. Shutting down...")
-            break
-
-        if time.time() - last_progress_update_time >= 20:
-            # It's been 20 seconds. Let's give the user an update
-            consume_all_from_sql_query_queue()
-            print("Progress: " + str(files_completed.value) + "/" + str(total_files) + " - " + 
-                  str(round(100 * int(files_completed.value) / total_files, 2)) + "%")
-            last_progress_update_time = time.time()
+    files_completed: int = 0
+    next_progress_update_time: float = time.time() + 20
+    """The next time we should offer the user a progress update"""
+    unexpected_exit: bool = False
+    """If true, something unexpected caused the process to exit"""
 
-        time.sleep(0.5)
+    stop_event: multiprocessing.synchronize.Event = multiprocessing.Event()
+    """Tells the workers to stop"""
+    signal_handler = SignalHandler(stop_event)
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=parsedargs["process_count"],
+                                                      initializer=init_worker,
+                                                      initargs=(stop_event,))
+    try:
+        pending_files: dict[concurrent.futures.Future, str] = {
+            executor.submit(process_one_file, input_file, os.fspath(intermediate_dir),
+                            parsedargs["decompress_whole_file"]): input_file
+            for input_file in input_files
+        }
+        """The input file that each task is processing"""
+        # Handle the files in the order they finish, so that a failure is
+        # noticed straight away.
+        for future in concurrent.futures.as_completed(pending_files):
+            try:
+                future.result()
+            except Exception:
+                traceback.print_exc()
+                print("ERROR: A worker has thrown an exception while processing \"" +
+                      str(pending_files[future]) + "\". Shutting down...")
+                unexpected_exit = True
+                break
+            files_completed += 1
+            if signal_handler.stop_requested:
+                unexpected_exit = True
+                break
 
-    consume_all_from_sql_query_queue()
+            if time.time() >= next_progress_update_time:
+                # It's been 20 seconds. Let's give the user an update
+                print("Progress: " + str(files_completed) + "/" + str(total_files) + " - " + 
+                      str(round(100 * files_completed / total_files, 2)) + "%")
+                next_progress_update_time = time.time() + 20
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
 
-    unexpected_exit: bool = False
-    """If true, something unexpected caused the process to exit"""
-    for process in worker_processes:
-        if process.is_alive():
-            # In normal circumstances, this code should only be
-            # reached if all proceses have exited.
-            process.terminate()
-            unexpected_exit = True
+    # Combine the queries found by each worker into the output file.
+    with open(parsedargs["output_file"], 'ab') as outputcsvfile:
+        for shard_path in sorted(intermediate_dir.glob("worker_*.csv")):
+            with open(shard_path, 'rb') as shard_file:
+                shutil.copyfileobj(shard_file, outputcsvfile, 1 << 20)
+            shard_path.unlink()
     
     if unexpected_exit:
         print("Something unexpected caused the program to exit.")
@@ -1,7 +1,167 @@
 import ast
-import pathlib
+import functools
+import hashlib
+import io
+import multiprocessing
 import re
+import token
+import tokenize
 import typing
+import warnings
+
+_FSTRING_START: int = getattr(token, "FSTRING_START", -1)
+"""The token type that starts an f-string (Python 3.12+ only)"""
+_FSTRING_END: int = getattr(token, "FSTRING_END", -1)
+"""The token type that ends an f-string (Python 3.12+ only)"""
+
+_IDENT_START: frozenset[str] = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_")
+"""Characters that can start a Python identifier (ASCII only)"""
+_IDENT_CONT_RUN: re.Pattern = re.compile("[A-Za-z0-9_]*")
+"""Matches the characters that continue a Python identifier (ASCII only)"""
+_FALLBACK_TOKEN: re.Pattern = re.compile(
+    r"(?P<string>[uUfF]?[\"'])|(?P<rawstring>[rR][\"'])|(?P<identifier>[A-Za-z_][A-Za-z0-9_]*)|"
+    r"(?P<whitespace>[ \t\r]+)|(?P<newline>\n)|(?P<comment>#[^\n]*)|(?P<add>\+)|(?P<unknown>[\s\S])")
+"""Matches the next token in `PythonExtractor._tokenize_fallback()`, naming its kind"""
+_AST_LEAVES: tuple[type, ...] = (ast.Name, ast.expr_context, ast.operator, ast.unaryop,
+                                 ast.cmpop, ast.boolop, ast.alias)
+"""Syntax tree nodes that never contain a string literal"""
+_JS_IDENT_START: frozenset[str] = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_().$0123456789")
+"""Characters that start an identifier in the JavaScript extractor"""
+_JS_IDENT_CONT_RUN: re.Pattern = re.compile(r"[A-Za-z.()0-9_]*")
+"""Matches the characters that continue an identifier in the JavaScript extractor"""
+_PHP_IDENT_START: frozenset[str] = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_()$0123456789")
+"""Characters that start an identifier in the PHP extractor"""
+_PHP_IDENT_CONT_RUN: re.Pattern = re.compile(r"[A-Za-z0-9_$(){}\[\]>\-]*")
+"""Matches the characters that continue an identifier in the PHP extractor"""
+_SQL_KEYWORDS: tuple[str, ...] = (
+    "SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "MERGE", "CREATE", "ALTER", "DROP", "TRUNCATE",
+    "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PREPARE TRANSACTION", "GRANT", "REVOKE",
+    "LOCK", "ANALYZE", "EXPLAIN", "DISCARD", "SET", "RESET", "SHOW", "VACUUM", "CHECKPOINT",
+    "CLUSTER", "REINDEX", "LISTEN", "NOTIFY", "UNLISTEN", "DO"
+)
+"""SQL keywords that can start a statement in PostgreSQL"""
+
+
+def _trie_pattern(words: typing.Iterable[str]) -> str:
+    """
+    Builds a regular expression that matches any of the words, like
+    "|".join(words) does. The alternatives are nested by common prefix, so
+    the regex engine rejects a position after its first character
+    instead of trying every word there.
+
+    :param words: The words to match
+    """
+    rests_by_first: dict[str, list[str]] = {}
+    """The rest of each word, grouped by its first character"""
+    can_end: bool = False
+    """Whether one of the words ends here"""
+    for word in words:
+        if word == "":
+            can_end = True
+        else:
+            rests_by_first.setdefault(word[0], []).append(word[1:])
+    branches: list[str] = [re.escape(first) + _trie_pattern(rests) for first, rests in sorted(rests_by_first.items())]
+    if len(branches) == 0:
+        return ""
+    pattern: str = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if can_end:
+        pattern = "(?:" + pattern + ")?"
+    return pattern
+
+
+_SQL_KEYWORD_PATTERN: re.Pattern = re.compile(r'\b(' + _trie_pattern(_SQL_KEYWORDS) + r')\b', re.IGNORECASE)
+"""Matches any SQL keyword that can start a statement"""
+_SQL_KEYWORD_SPACE_PATTERN: re.Pattern = re.compile(
+    r'\b(' + _trie_pattern(keyword + " " for keyword in _SQL_KEYWORDS) + r')\b', re.IGNORECASE)
+"""Matches any SQL keyword that can start a statement, followed by a space"""
+_TABLE_KEYWORDS: tuple[str, ...] = ("FROM", "UPDATE", "INTO", "TABLE" , "JOIN", "TABLE IF NOT EXISTS")
+"""SQL keywords that are followed by a table name"""
+_TABLE_KEYWORDS_MAX_LENGTH: int = max(len(keyword) for keyword in _TABLE_KEYWORDS)
+"""The length of the longest keyword in _TABLE_KEYWORDS"""
+_WHITESPACE: frozenset[str] = frozenset(" \t\r")
+"""Whitespace characters, other than line breaks"""
+_WHITESPACE_RUN: re.Pattern = re.compile("[ \t\r]*")
+"""Matches the rest of a run of whitespace characters, other than line breaks"""
+_PHP_WHITESPACE: frozenset[str] = frozenset(" \t")
+"""Whitespace characters in the PHP extractor, other than line breaks"""
+_PHP_WHITESPACE_RUN: re.Pattern = re.compile("[ \t]*")
+"""Matches the rest of a run of whitespace characters in the PHP extractor, other than line breaks"""
+_PHP_VARIABLE_PATTERN: re.Pattern = re.compile(r'(?:\{|\$)[^\s,\'\"]+')
+"""Matches {variables} or $variables in a PHP string"""
+_PHP_QUOTED_TABLE_PATTERN: re.Pattern = re.compile(
+    r"\b(FROM|JOIN|INTO|UPDATE|TABLE(?: IF EXISTS)?|DROP)(\s)'(\s\w+\s|\w+)'", re.IGNORECASE)
+"""Matches a quoted table name after a keyword, which doesn't work in PostgreSQL"""
+_STRING_BODY: dict[tuple[str, bool], re.Pattern] = {
+    (quote, triple_string): re.compile(r"(?:[^\\" + quote + r"]+|\\[\s\S]?" +
+                                       ("|" + quote + "(?!" + quote * 2 + ")" if triple_string else "") +
+                                       ")*")
+    for quote in ("\"", "'") for triple_string in (False, True)
+}
+"""
+Matches the contents of a string literal up to its closing quote, keyed by
+the quote character and whether the string is triple-quoted
+"""
+
+@functools.lru_cache(maxsize=8192)
+def _decode_python_string(literal: str) -> str:
+    """
+    Returns the value of a Python string literal token. bytes are decoded
+    as Latin-1, and the replacement fields of f-strings are kept as they
+    are written.
+
+    The same literals show up over and over, so results are cached.
+
+    :param literal: The string literal, with its prefix and quotes
+    :raises SyntaxError: or ValueError if the literal is not valid
+    """
+    prefix_length: int = 0
+    while literal[prefix_length] not in ("\"", "'"):
+        prefix_length += 1
+    prefix: str = literal[:prefix_length].lower()
+    original_literal: str = literal
+    if "f" in prefix:
+        # f-strings can't be evaluated as literals. Keep the
+        # replacement fields as they are written.
+        literal = literal[:prefix_length].replace("f", "").replace("F", "") + \
+                literal[prefix_length:]
+        prefix_length = len(literal) - len(original_literal) + prefix_length
+        prefix = prefix.replace("f", "")
+    quote_length: int = 3 if literal.startswith(literal[prefix_length] * 3, prefix_length) and \
+            len(literal) >= prefix_length + 6 else 1
+    body: str = literal[prefix_length + quote_length:len(literal) - quote_length]
+    # Most strings can be decoded without running the parser.
+    # Carriage returns and null characters are left to the parser,
+    # which normalizes line breaks and rejects null characters, and
+    # line breaks are only allowed in triple-quoted strings.
+    if "\r" not in body and "\0" not in body and (quote_length == 3 or "\n" not in body):
+        if "r" in prefix or "\\" not in body:
+            if "b" not in prefix or body.isascii():
+                return body
+        elif "b" not in prefix and body.isascii():
+            try:
+                return body.encode("ascii").decode("unicode_escape")
+            except UnicodeDecodeError:
+                pass
+    value: typing.Union[str, bytes] = ast.literal_eval(literal)
+    if isinstance(value, bytes):
+        return value.decode("latin-1")
+    return value
+
+def _file_extension(path: str) -> str:
+    """
+    Returns the lowercase extension of a file, such as ".py".
+
+    Same result as pathlib.Path(path).suffix.lower(), without building a
+    Path for every file. os.path.splitext() is slower, and differs for
+    names ending in a dot.
+
+    :param path: The path to the file, with "/" as the separator
+    """
+    last_slash: int = path.rfind("/")
+    last_dot: int = path.rfind(".")
+    if last_slash + 1 < last_dot < len(path) - 1:
+        return path[last_dot:].lower()
+    return ""
 
 class ParsingError(Exception):
     """
@@ -68,6 +228,23 @@ class Extractor:
         raise NotImplementedError("Subclasses of Extractor should implement" + 
                 "tokenize()")
     
+    def skip_string(self, index: int, close_string_char: str) -> int:
+        """
+        Skips over the contents of a string literal with backslash escapes.
+
+        :param index: The index just after the opening quote
+        :param close_string_char: The quote that closes the string
+        :return: The index just after the closing quote. For unterminated
+        strings, the length of the source code (plus one if it ends
+        partway through an escape sequence).
+        """
+        string_end: int = _STRING_BODY[(close_string_char, False)].match(self.source, index).end()  # type: ignore[union-attr]
+        if string_end < len(self.source):
+            # Skip the closing quote
+            return string_end + 1
+        trailing_backslashes: int = string_end - index - len(self.source[index:string_end].rstrip("\\"))
+        return string_end + trailing_backslashes % 2
+
     @property
     def source(self) -> str:
         """The source code of the file to extract candidate SQL queries from"""
@@ -85,50 +262,174 @@ class Extractor:
         :param path: The path to the file within the repository
         :param content: The content of the file.
         """
-        file_extension: str = pathlib.Path(path).suffix.lower()
-        extractor: typing.Optional[Extractor] = None
-        if file_extension == ".py":
-            extractor = PythonExtractor(content)
-        elif file_extension == ".js":
-            extractor = JavaScriptExtractor(content)
-        elif file_extension == ".php":
-            extractor = PHPExtractor(content)
-        else:
+        file_extension: str = _file_extension(path)
+        extractor_class: typing.Optional[type[Extractor]] = _EXTRACTOR_BY_EXTENSION.get(file_extension)
+        if extractor_class is None:
             raise ValueError("Unknown file type \"" + file_extension + "\"")
-        assert extractor is not None
-        return extractor.extract_strings()
+        if _SQL_KEYWORD_PATTERN.search(content) is None:
+            # Most files have no SQL in them. Without a keyword that can
+            # start a statement, there's no query to find.
+            return []
+        return extractor_class(content).extract_strings()
 
 
 class PythonExtractor(Extractor):
     """
     Extracts strings from Python files
     """
+    def extract_strings(self) -> list[str]:
+        """
+        Extracts SQL queries from the source code.
+
+        Python 3 source code is parsed with the standard library's `ast`
+        module, which is much faster than tokenizing it. Source code that
+        it can't parse (e.g. Python 2) is tokenized and parsed by hand
+        instead.
+
+        :return: A list of strings that were found in the
+        source code.
+        """
+        try:
+            with warnings.catch_warnings():
+                # Invalid escape sequences are common, and not our problem.
+                warnings.simplefilter("ignore")
+                tree: ast.AST = ast.parse(self.source)
+        except (SyntaxError, ValueError, RecursionError, MemoryError):
+            return super().extract_strings()
+        return self.extract_strings_from_ast(tree)
+
+    def extract_strings_from_ast(self, tree: ast.AST) -> list[str]:
+        """
+        Extracts the string literals from the syntax tree of the source
+        code, in the order they appear.
+
+        Strings that are concatenated with `+` are joined, with a
+        placeholder standing in for each variable between two strings.
+
+        :param tree: The syntax tree of the source code
+        """
+        strings: list[str] = []
+
+        def fstring_value(node: ast.JoinedStr) -> str:
+            """
+            Returns the value of an f-string, with the replacement fields
+            left in, e.g. "SELECT {col} FROM t".
+            """
+            value: str = ""
+            for part in node.values:
+                if isinstance(part, ast.FormattedValue):
+                    value += "{" + ast.unparse(part.value)
+                    if part.conversion != -1:
+                        value += "!" + chr(part.conversion)
+                    if isinstance(part.format_spec, ast.JoinedStr):
+                        value += ":" + fstring_value(part.format_spec)
+                    value += "}"
+                elif isinstance(part, ast.Constant):
+                    value += part.value
+            return value
+
+        def literal_value(node: ast.AST) -> typing.Optional[str]:
+            """Returns the value of a string literal, or None if `node` isn't one."""
+            if isinstance(node, ast.Constant):
+                if isinstance(node.value, str):
+                    return node.value
+                if isinstance(node.value, bytes):
+                    return node.value.decode("latin-1")
+                return None
+            if isinstance(node, ast.JoinedStr):
+                return fstring_value(node)
+            return None
+
+        stack: list[typing.Union[ast.AST, str]] = [tree]
+        """Nodes left to visit, and strings to output, in reverse order"""
+        while len(stack) > 0:
+            node: typing.Union[ast.AST, str] = stack.pop()
+            if isinstance(node, str):
+                strings.append(node)
+                continue
+            if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+                # Flatten a chain of additions (a + b + c)
+                operands: list[ast.AST] = [node.right]
+                left: ast.AST = node.left
+                while isinstance(left, ast.BinOp) and isinstance(left.op, ast.Add):
+                    operands.append(left.right)
+                    left = left.left
+                operands.append(left)
+                operands.reverse()
+
+                to_visit: list[typing.Union[ast.AST, str]] = []
+                """Strings and nodes in the order they appear"""
+                current_string: str = ""
+                placeholders: str = ""
+                """Placeholders for variables that haven't been followed by a string yet"""
+                for operand in operands:
+                    value: typing.Optional[str] = literal_value(operand)
+                    if value is not None:
+                        if current_string != "":
+                            current_string += placeholders
+                        current_string += value
+                        placeholders = ""
+                    elif isinstance(operand, ast.Name) and current_string != "":
+                        placeholders += "'placeholder'"
+                    else:
+                        if current_string != "":
+                            to_visit.append(current_string)
+                        current_string = ""
+                        placeholders = ""
+                        to_visit.append(operand)
+                if current_string != "":
+                    to_visit.append(current_string)
+                to_visit.reverse()
+                stack.extend(to_visit)
+                continue
+            value = literal_value(node)
+            if value is not None:
+                if value != "":
+                    strings.append(value)
+                continue
+            children: list[typing.Union[ast.AST, str]] = []
+            for field in node._fields:
+                child: typing.Any = getattr(node, field, None)
+                if isinstance(child, list):
+                    for item in child:
+                        if isinstance(item, ast.AST) and not isinstance(item, _AST_LEAVES):
+                            children.append(item)
+                elif isinstance(child, ast.AST) and not isinstance(child, _AST_LEAVES):
+                    children.append(child)
+            children.reverse()
+            stack.extend(children)
+
+        return strings
+
     def parse(self, tokens: list[tuple[str, str, int, int, int]]) -> list[str]:
 
         def parse_string(token: tuple[str, str, int, int, int]) -> str:
             """Parses a Python string."""
             try:
-                return ast.literal_eval("'" + token[1] + "'")
-            except SyntaxError:
-                # Find the last line break
-                last_line_break = token[4]
-                next_line_break = token[4]
+                return _decode_python_string(token[1])
+            except (SyntaxError, ValueError):
                 if token[4] >= len(self.source):
                     raise ParsingError(token[2], "", 0, "Potential unterminated string literal")
-                while last_line_break > 0 and self.source[last_line_break] != '\n':
-                    last_line_break -= 1
-                while next_line_break < len(self.source) - 1 and self.source[next_line_break] != '\n':
-                    next_line_break += 1
+                # Find the line the string is on
+                last_line_break: int = self.source.rfind('\n', 0, token[4] + 1)
+                next_line_break: int = self.source.find('\n', token[4])
+                if next_line_break == -1:
+                    next_line_break = len(self.source)
                 
                 raise ParsingError(token[2], self.source[last_line_break+1:next_line_break], token[3], "Failed to parse string")
 
+        # Local names are faster to look up in the loops below
+        token_count: int = len(tokens)
+        kind_string: str = self.TOKEN_STRING
+        kind_add: str = self.TOKEN_ADD
+        kind_identifier: str = self.TOKEN_IDENTIFIER
         strings: list[str] = []
         i: int = 0
-        while i < len(tokens):
+        while i < token_count:
             current_string: str = ""
 
-            while i < len(tokens):
-                if tokens[i][0] == (self.TOKEN_STRING):
+            while i < token_count:
+                if tokens[i][0] == (kind_string):
                     current_string += parse_string(tokens[i])
                 elif tokens[i][0] == "rawstring":
                     current_string += tokens[i][1]
@@ -139,36 +440,36 @@ class PythonExtractor(Extractor):
 
                 # Advance to the next token
                 i += 1
-                if i >= len(tokens):
+                if i >= token_count:
                     # We've reached the end.
                     break
-                if tokens[i][0] in (self.TOKEN_STRING, "rawstring"):
+                if tokens[i][0] in (kind_string, "rawstring"):
                     # Proceed to next token as planned
                     pass
-                elif tokens[i][0] in (self.TOKEN_ADD,):
+                elif tokens[i][0] in (kind_add,):
                     # This is an addition token. There might be something
                     # interesting here.
                     string_to_append: str = ""
                     """The string to append to the main string"""
-                    if i+1 >= len(tokens):
+                    if i+1 >= token_count:
                         # We've reached the end.
                         break
                     # Peek at the next token.
-                    while tokens[i+1][0] == self.TOKEN_IDENTIFIER:
+                    while tokens[i+1][0] == kind_identifier:
                         # Advance to the next token, which is an identifier
                         i += 1
-                        if i+1 >= len(tokens):
+                        if i+1 >= token_count:
                             # We've reached the end of the tokens.
                             break
                         # Peek at the next token again
-                        if tokens[i+1][0] == self.TOKEN_ADD:
+                        if tokens[i+1][0] == kind_add:
                             # Okay, let's loop again.
                             # Add a placeholder to the string
                             string_to_append += "'placeholder'"
                             # Advance to the next token.
                             i += 1
                             # Check if it is a string. If so, break out of this loop.
-                            if tokens[i+1][0] in (self.TOKEN_STRING, "rawstring"):
+                            if tokens[i+1][0] in (kind_string, "rawstring"):
                                 current_string += string_to_append
                                 break
                             # Okay, this token is not a string.
@@ -192,8 +493,77 @@ class PythonExtractor(Extractor):
         return strings
 
     def tokenize(self) -> list[tuple[str, str, int, int, int]]:
+        """
+        Tokenizes the source code using the standard library's `tokenize`
+        module. String tokens keep their prefix and quotes, exactly as
+        they are written in the source code.
+
+        Falls back to `_tokenize_fallback()` for source code that the
+        standard library refuses to tokenize (e.g. inconsistent
+        indentation in Python 2 code).
+        """
+        line_offsets: list[int] = [0]
+        """The index in the source code at which each line starts"""
+        for line_break in re.finditer("\n", self.source):
+            line_offsets.append(line_break.end())
+
         tokens_list: list[tuple[str, str, int, int, int]] = []
-        
+        fstring_start: typing.Optional[tuple[int, int]] = None
+        """Where the outermost f-string being tokenized starts (Python 3.12+)"""
+        fstring_depth: int = 0
+        try:
+            for tok in tokenize.generate_tokens(io.StringIO(self.source).readline):
+                if tok.type in (token.NEWLINE, token.NL, token.INDENT, token.DEDENT,
+                                token.COMMENT, token.ENDMARKER):
+                    # Not a token (we ignore line breaks and indents for now)
+                    continue
+                end_index: int = line_offsets[tok.end[0] - 1] + tok.end[1]
+                if tok.type == _FSTRING_START:
+                    if fstring_depth == 0:
+                        fstring_start = tok.start
+                    fstring_depth += 1
+                elif tok.type == _FSTRING_END:
+                    fstring_depth -= 1
+                    if fstring_depth == 0:
+                        # Treat the whole f-string as a single string token
+                        assert fstring_start is not None
+                        start_index: int = line_offsets[fstring_start[0] - 1] + fstring_start[1]
+                        tokens_list.append((self.TOKEN_STRING, self.source[start_index:end_index],
+                                            tok.end[0] - 1, tok.end[1], end_index))
+                elif fstring_depth > 0:
+                    # Inside an f-string
+                    pass
+                elif tok.type == token.STRING:
+                    tokens_list.append((self.TOKEN_STRING, tok.string, tok.end[0] - 1,
+                                        tok.end[1], end_index))
+                elif tok.type == token.OP and tok.string == "+":
+                    tokens_list.append((self.TOKEN_ADD, tok.string, tok.end[0] - 1,
+                                        tok.end[1], end_index))
+                elif tok.type == token.NAME and len(tokens_list) > 0 and \
+                        tokens_list[-1][0] == self.TOKEN_ADD:
+                    # parse() only looks at identifiers that are being
+                    # concatenated; any other identifier just separates
+                    # strings, like an unknown token.
+                    tokens_list.append((self.TOKEN_IDENTIFIER, tok.string, tok.end[0] - 1,
+                                        tok.end[1], end_index))
+                elif len(tokens_list) > 0 and tokens_list[-1][0] != self.TOKEN_UNKNOWN:
+                    # A run of unknown tokens means the same thing to
+                    # parse() as a single one, so only the first is kept.
+                    tokens_list.append((self.TOKEN_UNKNOWN, tok.string, tok.end[0] - 1,
+                                        tok.end[1], end_index))
+        except (tokenize.TokenError, SyntaxError):
+            return self._tokenize_fallback()
+
+        return tokens_list
+
+    def _tokenize_fallback(self) -> list[tuple[str, str, int, int, int]]:
+        """
+        Tokenizes the source code by hand. Slower and less accurate than
+        `tokenize()`, but tolerant of source code that isn't valid
+        Python 3.
+        """
+        tokens_list: list[tuple[str, str, int, int, int]] = []
+
         index: int = 0
         """The index we are at in the source code"""
         
@@ -203,21 +573,37 @@ class PythonExtractor(Extractor):
         line_number: int = 0
         """The line number we are at in the source code"""
 
-        while index < len(self.source):
-            if self.source[index] == '#':
+        source_length: int = len(self.source)
+        while index < source_length:
+            token_match: re.Match = _FALLBACK_TOKEN.match(self.source, index)  # type: ignore[assignment]
+            token_kind: typing.Optional[str] = token_match.lastgroup
+            if token_kind == "identifier":
+                # This is an identifier
+                index = token_match.end()
+                tokens_list.append((self.TOKEN_IDENTIFIER, token_match.group(), line_number, 
+                                    index - last_line_break, index))
+            elif token_kind == "whitespace":
+                # A space is not a token (we ignore indents for now)
+                index = token_match.end()
+            elif token_kind == "newline":
+                line_number += 1
+                index += 1
+            elif token_kind == "unknown":
+                # Unknown token
+                tokens_list.append((self.TOKEN_UNKNOWN, self.source[index], line_number,
+                                    index - last_line_break, index))
+                index += 1
+            elif token_kind == "comment":
                 # Inside a comment
-                while index < len(self.source) and self.source[index] != '\n':
-                    index += 1
+                index = token_match.end()
                 line_number += 1
                 last_line_break = index
-            elif self.source[index] == '+':
+            elif token_kind == "add":
                 # Addition token
                 index += 1
                 tokens_list.append((self.TOKEN_ADD, '+', line_number, 
                                     index - last_line_break, index))
-            elif self.source[index] in ("\"", "\'") or \
-                    self.source[index:index+2] in ("u\"", "U\"", "u'", "U'") or \
-                    self.source[index:index+2] in ("f\"", "F\"", "f'", "F'"):
+            elif token_kind == "string":
                 # Normal string with escapes
                 # TODO Separate f strings into their own thing
                 close_string_char: str = self.source[index]
@@ -238,158 +624,85 @@ class PythonExtractor(Extractor):
                 else:
                     close_string_char = self.source[index]
                     index += 1
-                current_string: str = ""
-                while index < len(self.source):
+                string_end: int = _STRING_BODY[(close_string_char, triple_string)].match(
+                    self.source, index).end()
+                """Where the closing quote of the string is"""
+                string_pieces: list[str] = []
+                while True:
+                    escape_start: int = self.source.find("\\", index, string_end)
+                    segment_end: int = escape_start if escape_start != -1 else string_end
                     if triple_string:
-                        if self.source[index:index+3] == (close_string_char * 3):
-                            # The string is finished
-                            index += 3
-                            break
-                    elif self.source[index] == close_string_char:
-                        # The string is finished
-                        index += 1
+                        line_breaks: int = self.source.count("\n", index, segment_end)
+                        if line_breaks > 0:
+                            line_number += line_breaks
+                            last_line_break = self.source.rfind("\n", index, segment_end)
+                    # Escape everything between escape sequences in one go
+                    segment: str = self.source[index:segment_end].replace("'", "\\'").replace('"', '\\"')
+                    if triple_string:
+                        segment = segment.replace("\n", "\\n").replace("\r", "\\r\r")
+                    string_pieces.append(segment)
+                    if escape_start == -1:
                         break
-                    if self.source[index] == "\\":
-                        # Start of an escape sequence
-                        current_string += self.source[index:index+2]
-                        index += 2
-                    else:
-                        # Escape line breaks inside a triple string
-                        if triple_string and self.source[index] == "\r":
-                            current_string += "\\r"
-                        if triple_string and self.source[index] == "\n":
-                            line_number += 1
-                            last_line_break = index
-                            current_string += "\\n"
-                        elif self.source[index] == "'":
-                            current_string += "\\'"
-                        elif self.source[index] == '"':
-                            current_string += '\\"'
-                        else:
-                            current_string += self.source[index]
-                        index += 1
-                tokens_list.append((self.TOKEN_STRING, current_string, line_number, 
+                    # Escape sequences are kept as they are
+                    string_pieces.append(self.source[escape_start:escape_start+2])
+                    index = escape_start + 2
+                if string_end < len(self.source):
+                    # Skip past the closing quote(s)
+                    index = string_end + (3 if triple_string else 1)
+                else:
+                    # Unterminated
+                    index = max(index, string_end)
+                tokens_list.append((self.TOKEN_STRING, "'" + "".join(string_pieces) + "'", line_number, 
                                     index - last_line_break, index))
-            elif self.source[index:index+2] in ("r\"", "R\"", "r'", "R'"):
+            else:
                 # Raw string, no escapes
                 close_string_char = self.source[index+1]
-                current_rawstring: str = ""
                 index += 2
-                while index < len(self.source) and self.source[index] != close_string_char:
-                    current_rawstring += self.source[index]
-                    index += 1
-                index += 1
+                rawstring_end: int = self.source.find(close_string_char, index)
+                if rawstring_end == -1:
+                    # Unterminated
+                    rawstring_end = len(self.source)
+                current_rawstring: str = self.source[index:rawstring_end]
+                index = rawstring_end + 1
                 tokens_list.append(("rawstring", current_rawstring, line_number, 
                                     index - last_line_break, index))
-            elif re.match(r"[A-Za-z_]", self.source[index]):
-                # This is an identifier
-                current_identifier: str = self.source[index]
-                index += 1
-                while index < len(self.source) and re.match(r"[A-Za-z0-9_]", self.source[index]):
-                    current_identifier += self.source[index]
-                    index += 1
-                tokens_list.append((self.TOKEN_IDENTIFIER, current_identifier, line_number, 
-                                    index - last_line_break, index))
-            elif self.source[index] in ('\n'):
-                line_number += 1
-                index += 1
-            elif self.source[index] in (' ', '\t', '\r'):
-                # A space is not a token (we ignore indents for now)
-                index += 1
-            else:
-                # Unknown token
-                tokens_list.append((self.TOKEN_UNKNOWN, self.source[index], line_number,
-                                    index - last_line_break, index))
-                index += 1
         
         return tokens_list
 
-class JavaScriptExtractor(Extractor):
-    """
-    Extracts strings from JavaScript files
+class KeywordRegionExtractor(Extractor):
     """
-    def parse(self, tokens: list[tuple[str, str, int, int, int]]) -> list[str]:
-        strings: list[str] = []
-        i: int = 0
-
-        while i < len(tokens):
-            current_string: str = ""
-
-            while i < len(tokens):
-                if tokens[i][0] == (self.TOKEN_STRING):
-                    current_string += tokens[i][1]
-                else:
-                    # Not a string, let's loop again.
-                    break
-                
-                # Advance to the next token
-                i += 1
-                if i >= len(tokens):
-                    # We've reached the end.
-                    break
-
-                table_number: int = 1
-                placeholder_number: int = 1
-
-                # Loop through concatenation
-                while i < len(tokens) and tokens[i][0] in (self.TOKEN_ADD):
-                    string_to_append: str = ""
-
-                    if (i+1 >= len(tokens)):
-                        break
-                    elif (tokens[i+1][0] == self.TOKEN_NEWLINE): # Add newline to string
-                        current_string += "\n"
-                        i += 1
-                        while tokens[i+1][0] == self.TOKEN_NEWLINE:
-                            i += 1
-                    
-                    if (i+1 >= len(tokens)):
-                        break
-                    elif (tokens[i+1][0] == self.TOKEN_IDENTIFIER): # Add tbl or placeholder to string in place of concatenated identifier
-                        while i+1 < len(tokens) and tokens[i+1][0] == self.TOKEN_IDENTIFIER:
-                            i += 1
-                        
-                        current_string_rstrip = current_string.rstrip()
-                        if (current_string_rstrip.upper().endswith(tuple(["FROM", "UPDATE", "INTO", "TABLE" , "JOIN", "TABLE IF NOT EXISTS"]))):
-                            string_to_append = "tbl" + str(table_number)
-                            table_number += 1
-                        else:
-                            string_to_append = "placeholder" + str(placeholder_number)
-                            placeholder_number += 1
-
-                    elif (tokens[i+1][0] == self.TOKEN_STRING): # append string to string
-                        string_to_append = tokens[i+1][1]
-                        i += 1
-                    
-                    current_string += string_to_append
-                    i += 1
-                    
-            # Add the current string to the list, if it is nonempty
-            if current_string != "":
-                strings.append(current_string)
-
-            i += 1
-        
-        # Filter out/prepare strings
-        filtered_strings = []
-        for string in strings:
-            # Check for valid postgres
-            if (string.find(" ") != -1 and len(string) > 5):
-                string = string.replace("\\\"", "\"")
-                string = string.replace ("\\'", "'")
-                string = string.replace("?", "'placeholder_value'")
+    The base class for languages with C-style comments, where only the
+    code around SQL keywords is tokenized.
 
-                upper = string.upper()
+    Subclasses describe their syntax with the class attributes below.
 
-                if (self.check_sql_keyword(string)) \
-                    and len(string) < 1000 and string.find("<") != 0 and \
-                    upper != "SELECT ALL" and string.find(" ") != -1 and upper != "SHOW ALL" and \
-                    upper != "LOCK RATIO" and upper != "LOCK UNLOCK":
-                        filtered_strings.append(string)
-        
-        return filtered_strings
+    Abstract. Not meant to be directly instantiated
+    """
+    CONCAT_OPERATOR: str = "+"
+    """The operator that concatenates strings"""
+    IDENTIFIER_START: frozenset[str] = _JS_IDENT_START
+    """Characters that start an identifier"""
+    IDENTIFIER_CONTINUE_RUN: re.Pattern = _JS_IDENT_CONT_RUN
+    """Matches the characters that continue an identifier"""
+    NEWLINE_CHARACTERS: str = "\n"
+    """Characters that are treated as line breaks"""
+    WHITESPACE: frozenset[str] = _WHITESPACE
+    """Characters that are skipped between tokens"""
+    WHITESPACE_RUN: re.Pattern = _WHITESPACE_RUN
+    """Matches a run of the characters in WHITESPACE"""
+    UNKNOWN_CONTINUES: str = ""
+    """Unknown characters that don't end the region around a keyword"""
 
     def tokenize(self) -> list[tuple[str, str, int, int, int]]:
+        # Look these up once, rather than for every character
+        concat_operator: str = self.CONCAT_OPERATOR
+        identifier_start: frozenset[str] = self.IDENTIFIER_START
+        identifier_continue_run: re.Pattern = self.IDENTIFIER_CONTINUE_RUN
+        newline_characters: str = self.NEWLINE_CHARACTERS
+        whitespace: frozenset[str] = self.WHITESPACE
+        whitespace_run: re.Pattern = self.WHITESPACE_RUN
+        unknown_continues: str = self.UNKNOWN_CONTINUES
+
         tokens_list: list[tuple[str, str, int, int, int]] = []
         
         index: int = 0
@@ -408,25 +721,27 @@ class JavaScriptExtractor(Extractor):
             index = next_index - 1
 
             while index < len(self.source):
-                if self.source[index:index+2] == ("//"):
+                if self.source.startswith("//", index):
                     # Inside a single-line comment
-                    while index < len(self.source) and self.source[index] != '\n':
-                        index += 1
+                    index = self.source.find('\n', index)
+                    if index == -1:
+                        index = len(self.source)
                     line_number += 1
                     last_line_break = index
-                elif self.source[index:index+2] == ("/*"):    
+                elif self.source.startswith("/*", index):    
                     # Inside a block comment
-                    while index < len(self.source) and self.source[index:index+2] != ("*/"):
-                        if (self.source[index] != '\n'):
-                            index += 1
-                        else:
-                            line_number += 1
-                            last_line_break = index
-                            index += 1               
-                elif self.source[index] == '+':
+                    comment_end: int = self.source.find("*/", index)
+                    if comment_end == -1:
+                        comment_end = len(self.source)
+                    line_breaks: int = self.source.count('\n', index, comment_end)
+                    if line_breaks > 0:
+                        line_number += line_breaks
+                        last_line_break = self.source.rfind('\n', index, comment_end)
+                    index = comment_end
+                elif self.source[index] == concat_operator:
                     # Addition token
                     index += 1
-                    tokens_list.append((self.TOKEN_ADD, '+', line_number, 
+                    tokens_list.append((self.TOKEN_ADD, concat_operator, line_number, 
                                         index - last_line_break, index))
                 elif self.source[index] in ("\"", "\'"):
                     # Normal string with escapes
@@ -435,48 +750,33 @@ class JavaScriptExtractor(Extractor):
                     if index >= len(self.source):
                         raise ParsingError(line_number, self.source[last_line_break:], len(self.source) - 1, 
                                         "Unterminated string literal")
-                    current_string: str = ""
                     start_index = index
-                    while index < len(self.source):
-                        if self.source[index] == close_string_char:
-                            # The string is finished
-                            index += 1
-                            break
-                        if self.source[index] == "\\":
-                            # Start of an escape sequence
-                            index += 2
-                        else:
-                            index += 1
-
-                    current_string = self.source[start_index:index-1]
-                    tokens_list.append((self.TOKEN_STRING, current_string, line_number, 
+                    index = self.skip_string(index, close_string_char)
+                    tokens_list.append((self.TOKEN_STRING, self.source[start_index:index-1], line_number, 
                                         index - last_line_break, index))
-                elif re.match(r"[A-Za-z_().$0-9]", self.source[index]):
+                elif self.source[index] in identifier_start:
                     # This is an identifier
-                    current_identifier: str = "" #self.source[index]
                     start_index = index
-                    index += 1
-                    while index < len(self.source) and re.match(r"[A-Za-z.()0-9_]", self.source[index]):
-                        index += 1
-                    current_identifier = self.source[start_index:index]
-
-                    #print(current_identifier)
-                    tokens_list.append((self.TOKEN_IDENTIFIER, current_identifier, line_number, 
+                    index = identifier_continue_run.match(self.source, index + 1).end()  # type: ignore[union-attr]
+                    tokens_list.append((self.TOKEN_IDENTIFIER, self.source[start_index:index], line_number, 
                                         index - last_line_break, index))
-                elif self.source[index] in ('\n'):
+                elif self.source[index] in newline_characters:
                     tokens_list.append((self.TOKEN_NEWLINE, "\n", line_number, 
                                         index - last_line_break, index))
                     line_number += 1
                     index += 1
-                elif self.source[index] in (' ', '\t', '\r'):
+                elif self.source[index] in whitespace:
                     # A space is not a token (we ignore indents for now)
-                    index += 1
+                    index = whitespace_run.match(self.source, index + 1).end()  # type: ignore[union-attr]
                 else:
                     # Unknown token
                     tokens_list.append((self.TOKEN_UNKNOWN, self.source[index], line_number,
                                         index - last_line_break, index))
                     index += 1
-                    break;
+
+                    if self.source[index-1] not in unknown_continues:
+                        break
+            
             if index == next_index:
                 index += 1
             next_index = self.find_next_keyword(index)
@@ -486,56 +786,36 @@ class JavaScriptExtractor(Extractor):
 
     def find_next_keyword(self, index):
         # Finds index of next SQL keyword
-
-        # List of SQL keywords that can start a statement in PostgreSQL
-        sql_keywords = [
-            "SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "MERGE", "CREATE", "ALTER", "DROP", "TRUNCATE",
-            "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PREPARE TRANSACTION", "GRANT", "REVOKE",
-            "LOCK", "ANALYZE", "EXPLAIN", "DISCARD", "SET", "RESET", "SHOW", "VACUUM", "CHECKPOINT",
-            "CLUSTER", "REINDEX", "LISTEN", "NOTIFY", "UNLISTEN", "DO"
-        ]
-        
-        # regex pattern that matches any of these keywords
-        pattern = re.compile(r'\b(' + '|'.join(sql_keywords) + r')\b', re.IGNORECASE)
+        match = _SQL_KEYWORD_PATTERN.search(self.source, index)
         
-        match = pattern.search(self.source[index:])
-        
-        return match.start() + index if match else None
+        return match.start() if match else None
 
     def check_sql_keyword(self, string):
         # Checks if string has a SQL keyword
 
-        # List of SQL keywords that can start a statement in PostgreSQL
-        sql_keywords = [
-            "SELECT ", "WITH ", "INSERT ", "UPDATE ", "DELETE ", "MERGE ", "CREATE ", "ALTER ", "DROP ", "TRUNCATE ",
-            "BEGIN ", "COMMIT ", "ROLLBACK ", "SAVEPOINT ", "RELEASE ", "PREPARE TRANSACTION ", "GRANT ", "REVOKE ",
-            "LOCK ", "ANALYZE ", "EXPLAIN ", "DISCARD ", "SET ", "RESET ", "SHOW ", "VACUUM ", "CHECKPOINT ",
-            "CLUSTER ", "REINDEX ", "LISTEN ", "NOTIFY ", "UNLISTEN ", "DO "
-        ]
-        
-        #pattern that matches any of these keywords
-        pattern = re.compile(r'\b(' + '|'.join(sql_keywords) + r')\b', re.IGNORECASE)
-        
-        match = pattern.search(string)
+        match = _SQL_KEYWORD_SPACE_PATTERN.search(string)
         
         return True if match else False
     
-class PHPExtractor(Extractor):
+class JavaScriptExtractor(KeywordRegionExtractor):
     """
     Extracts strings from JavaScript files
     """
     def parse(self, tokens: list[tuple[str, str, int, int, int]]) -> list[str]:
+        # Local names are faster to look up in the loops below
+        token_count: int = len(tokens)
+        kind_string: str = self.TOKEN_STRING
+        kind_add: str = self.TOKEN_ADD
+        kind_identifier: str = self.TOKEN_IDENTIFIER
+        kind_newline: str = self.TOKEN_NEWLINE
         strings: list[str] = []
         i: int = 0
 
-        while i < len(tokens):
+        while i < token_count:
             current_string: str = ""
 
-            table_number: int = 1
-            placeholder_number: int = 1
-
-            while i < len(tokens):
-                if tokens[i][0] == (self.TOKEN_STRING):
+            while i < token_count:
+                if tokens[i][0] == (kind_string):
                     current_string += tokens[i][1]
                 else:
                     # Not a string, let's loop again.
@@ -543,44 +823,42 @@ class PHPExtractor(Extractor):
                 
                 # Advance to the next token
                 i += 1
-                if i >= len(tokens):
+                if i >= token_count:
                     # We've reached the end.
                     break
 
+                table_number: int = 1
+                placeholder_number: int = 1
 
                 # Loop through concatenation
-                while i < len(tokens) and tokens[i][0] in (self.TOKEN_ADD):
+                while i < token_count and tokens[i][0] in (kind_add):
                     string_to_append: str = ""
 
-                    if (i+1 >= len(tokens)):
+                    if (i+1 >= token_count):
                         break
-                    elif (tokens[i+1][0] == self.TOKEN_NEWLINE): # Add newline to string
+                    elif (tokens[i+1][0] == kind_newline): # Add newline to string
                         current_string += "\n"
                         i += 1
-                        while tokens[i+1][0] == self.TOKEN_NEWLINE:
+                        while tokens[i+1][0] == kind_newline:
                             i += 1
                     
-                    if (i+1 >= len(tokens)):
+                    if (i+1 >= token_count):
                         break
-                    elif (tokens[i+1][0] == self.TOKEN_IDENTIFIER): # Add tbl or placeholder to string in place of concatenated identifier
-                        while i+1 < len(tokens) and tokens[i+1][0] == self.TOKEN_IDENTIFIER:
+                    elif (tokens[i+1][0] == kind_identifier): # Add tbl or placeholder to string in place of concatenated identifier
+                        while i+1 < token_count and tokens[i+1][0] == kind_identifier:
                             i += 1
                         
+                        # Only the end of the string can hold the keyword,
+                        # so don't uppercase the whole thing.
                         current_string_rstrip = current_string.rstrip()
-                        if (current_string_rstrip.upper().endswith(tuple(["FROM", "UPDATE", "INTO", "TABLE" , "JOIN", "TABLE IF NOT EXISTS"]))):
+                        if (current_string_rstrip[-_TABLE_KEYWORDS_MAX_LENGTH:].upper().endswith(_TABLE_KEYWORDS)):
                             string_to_append = "tbl" + str(table_number)
                             table_number += 1
                         else:
                             string_to_append = "placeholder" + str(placeholder_number)
                             placeholder_number += 1
-                        
-
-                        if (i + 3 < len(tokens) and tokens[i+1][0] == self.TOKEN_STRING and tokens[i+2][0] == self.TOKEN_UNKNOWN and tokens[i+3][0] == self.TOKEN_ADD):
-                            i += 2
-                        elif (i + 4 < len(tokens) and tokens[i+1][0] == self.TOKEN_STRING and tokens[i+2][0] == self.TOKEN_UNKNOWN and tokens[i+3][0] == self.TOKEN_IDENTIFIER and tokens[i+4][0] == self.TOKEN_ADD):
-                            i += 3
 
-                    elif (tokens[i+1][0] == self.TOKEN_STRING): # append string to string
+                    elif (tokens[i+1][0] == kind_string): # append string to string
                         string_to_append = tokens[i+1][1]
                         i += 1
                     
@@ -589,13 +867,10 @@ class PHPExtractor(Extractor):
                     
             # Add the current string to the list, if it is nonempty
             if current_string != "":
-                current_string = self.filter_query_php(current_string, table_number, placeholder_number)
                 strings.append(current_string)
 
             i += 1
         
-        valid = []
-        invalid = []
         # Filter out/prepare strings
         filtered_strings = []
         for string in strings:
@@ -605,128 +880,130 @@ class PHPExtractor(Extractor):
                 string = string.replace ("\\'", "'")
                 string = string.replace("?", "'placeholder_value'")
 
-                upper = string.upper()
-
-                if (self.check_sql_keyword(string)) \
-                    and len(string) < 1000 and string.find("<") != 0 and upper != "SELECT ALL":
+                # Cheapest checks first
+                if len(string) < 1000 and not string.startswith("<") and \
+                    _SQL_KEYWORD_SPACE_PATTERN.search(string) and \
+                    string.upper() not in ("SELECT ALL", "SHOW ALL", "LOCK RATIO", "LOCK UNLOCK"):
                         filtered_strings.append(string)
-
+        
         return filtered_strings
 
-    def tokenize(self) -> list[tuple[str, str, int, int, int]]:
-        tokens_list: list[tuple[str, str, int, int, int]] = []
-        
-        index: int = 0
-        """The index we are at in the source code"""
-        
-        last_line_break: int = 0
-        """The last time we had a line break"""
+class PHPExtractor(KeywordRegionExtractor):
+    """
+    Extracts strings from JavaScript files
+    """
+    CONCAT_OPERATOR: str = "."
+    IDENTIFIER_START: frozenset[str] = _PHP_IDENT_START
+    IDENTIFIER_CONTINUE_RUN: re.Pattern = _PHP_IDENT_CONT_RUN
+    NEWLINE_CHARACTERS: str = "\n\r"
+    WHITESPACE: frozenset[str] = _PHP_WHITESPACE
+    WHITESPACE_RUN: re.Pattern = _PHP_WHITESPACE_RUN
+    UNKNOWN_CONTINUES: str = "]"
 
-        line_number: int = 0
-        """The line number we are at in the source code"""
+    def parse(self, tokens: list[tuple[str, str, int, int, int]]) -> list[str]:
+        # Local names are faster to look up in the loops below
+        token_count: int = len(tokens)
+        kind_string: str = self.TOKEN_STRING
+        kind_add: str = self.TOKEN_ADD
+        kind_identifier: str = self.TOKEN_IDENTIFIER
+        kind_newline: str = self.TOKEN_NEWLINE
+        kind_unknown: str = self.TOKEN_UNKNOWN
+        strings: list[str] = []
+        i: int = 0
 
-        # Find keywords
-        next_index = self.find_next_keyword(index)
+        while i < token_count:
+            current_string: str = ""
 
-        while next_index != None and index < len(self.source):
-            index = next_index - 1
+            table_number: int = 1
+            placeholder_number: int = 1
 
-            while index < len(self.source):
-                if self.source[index:index+2] == "//":
-                    # Inside a single-line comment
-                    while index < len(self.source) and self.source[index] != '\n':
-                        #print(self.source[index])
-                        index += 1
-                    line_number += 1
-                    last_line_break = index
-                elif self.source[index:index+2] == ("/*"):    
-                    # Inside a block comment
-                    while index < len(self.source) and self.source[index:index+2] != ("*/"):
-                        if (self.source[index] != '\n'):
-                            index += 1
-                        else:
-                            line_number += 1
-                            last_line_break = index
-                            index += 1               
-                elif self.source[index] == '.':
-                    # Addition token
-                    index += 1
-                    tokens_list.append((self.TOKEN_ADD, '.', line_number, 
-                                        index - last_line_break, index))
-                elif self.source[index] in ("\"", "\'"):
-                    # Normal string with escapes
-                    close_string_char: str = self.source[index]
-                    index += 1
-                    if index >= len(self.source):
-                        raise ParsingError(line_number, self.source[last_line_break:], len(self.source) - 1, 
-                                        "Unterminated string literal")
-                    current_string: str = ""
-                    start_index = index
-                    while index < len(self.source):
-                        if self.source[index] == close_string_char:
-                            # The string is finished
-                            index += 1
-                            break
-                        if self.source[index] == "\\":
-                            # Start of an escape sequence
-                            index += 2
+            while i < token_count:
+                if tokens[i][0] == (kind_string):
+                    current_string += tokens[i][1]
+                else:
+                    # Not a string, let's loop again.
+                    break
+                
+                # Advance to the next token
+                i += 1
+                if i >= token_count:
+                    # We've reached the end.
+                    break
+
+
+                # Loop through concatenation
+                while i < token_count and tokens[i][0] in (kind_add):
+                    string_to_append: str = ""
+
+                    if (i+1 >= token_count):
+                        break
+                    elif (tokens[i+1][0] == kind_newline): # Add newline to string
+                        current_string += "\n"
+                        i += 1
+                        while tokens[i+1][0] == kind_newline:
+                            i += 1
+                    
+                    if (i+1 >= token_count):
+                        break
+                    elif (tokens[i+1][0] == kind_identifier): # Add tbl or placeholder to string in place of concatenated identifier
+                        while i+1 < token_count and tokens[i+1][0] == kind_identifier:
+                            i += 1
+                        
+                        # Only the end of the string can hold the keyword,
+                        # so don't uppercase the whole thing.
+                        current_string_rstrip = current_string.rstrip()
+                        if (current_string_rstrip[-_TABLE_KEYWORDS_MAX_LENGTH:].upper().endswith(_TABLE_KEYWORDS)):
+                            string_to_append = "tbl" + str(table_number)
+                            table_number += 1
                         else:
-                            index += 1
+                            string_to_append = "placeholder" + str(placeholder_number)
+                            placeholder_number += 1
+                        
 
-                    current_string = self.source[start_index:index-1]
-                    tokens_list.append((self.TOKEN_STRING, current_string, line_number, 
-                                        index - last_line_break, index))
-                elif re.match(r"[A-Za-z_()$0-9]", self.source[index]):
-                    # This is an identifier
-                    current_identifier: str = "" #self.source[index]
-                    start_index = index
-                    index += 1
-                    while index < len(self.source) and re.match(r"[A-Za-z0-9_$(){}\[\]>\-]", self.source[index]):
-                        index += 1
-                    current_identifier = self.source[start_index:index]
+                        if (i + 3 < token_count and tokens[i+1][0] == kind_string and tokens[i+2][0] == kind_unknown and tokens[i+3][0] == kind_add):
+                            i += 2
+                        elif (i + 4 < token_count and tokens[i+1][0] == kind_string and tokens[i+2][0] == kind_unknown and tokens[i+3][0] == kind_identifier and tokens[i+4][0] == kind_add):
+                            i += 3
 
-                    tokens_list.append((self.TOKEN_IDENTIFIER, current_identifier, line_number, 
-                                        index - last_line_break, index))
-                elif self.source[index] in ('\n', '\r'):
-                    tokens_list.append((self.TOKEN_NEWLINE, "\n", line_number, 
-                                        index - last_line_break, index))
-                    line_number += 1
-                    index += 1
-                elif self.source[index] in (' ', '\t'):
-                    # A space is not a token (we ignore indents for now)
-                    index += 1
-                else:
-                    # Unknown token
-                    tokens_list.append((self.TOKEN_UNKNOWN, self.source[index], line_number,
-                                        index - last_line_break, index))
-                    index += 1
+                    elif (tokens[i+1][0] == kind_string): # append string to string
+                        string_to_append = tokens[i+1][1]
+                        i += 1
+                    
+                    current_string += string_to_append
+                    i += 1
+                    
+            # Add the current string to the list, if it is nonempty
+            if current_string != "":
+                current_string = self.filter_query_php(current_string, table_number, placeholder_number)
+                strings.append(current_string)
 
-                    if (self.source[index-1] != ']'):
-                        break;
-            
-            if index == next_index:
-                index += 1
-            next_index = self.find_next_keyword(index)
+            i += 1
+        
+        valid = []
+        invalid = []
+        # Filter out/prepare strings
+        filtered_strings = []
+        for string in strings:
+            # Check for valid postgres
+            if (string.find(" ") != -1 and len(string) > 5):
+                string = string.replace("\\\"", "\"")
+                string = string.replace ("\\'", "'")
+                string = string.replace("?", "'placeholder_value'")
 
-        return tokens_list
+                # Cheapest checks first
+                if len(string) < 1000 and not string.startswith("<") and \
+                    _SQL_KEYWORD_SPACE_PATTERN.search(string) and \
+                    string.upper() != "SELECT ALL":
+                        filtered_strings.append(string)
 
+        return filtered_strings
 
     def find_next_keyword(self, index):
-        # List of SQL keywords that can start a statement in PostgreSQL
-        sql_keywords = [
-            "SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "MERGE", "CREATE", "ALTER", "DROP", "TRUNCATE",
-            "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PREPARE TRANSACTION", "GRANT", "REVOKE",
-            "LOCK", "ANALYZE", "EXPLAIN", "DISCARD", "SET", "RESET", "SHOW", "VACUUM", "CHECKPOINT",
-            "CLUSTER", "REINDEX", "LISTEN", "NOTIFY", "UNLISTEN", "DO"
-        ]
-        
-        # Regex pattern that matches any of these keywords
-        pattern = re.compile(r'\b(' + '|'.join(sql_keywords) + r')\b', re.IGNORECASE)
-        
-        match = pattern.search(self.source[index:])
+        # Finds index of next SQL keyword
+        match = _SQL_KEYWORD_PATTERN.search(self.source, index)
         
         if match:
-            keyword_index = match.start() + index
+            keyword_index = match.start()
             last_newline = self.source.rfind('\n', index, keyword_index)
             next_newline = self.source.find('\n', keyword_index)
             
@@ -739,24 +1016,6 @@ class PHPExtractor(Extractor):
         
         return None
 
-    def check_sql_keyword(self, string):
-        # Checks if string has a SQL keyword
-
-        # List of SQL keywords that can start a statement in PostgreSQL
-        sql_keywords = [
-            "SELECT ", "WITH ", "INSERT ", "UPDATE ", "DELETE ", "MERGE ", "CREATE ", "ALTER ", "DROP ", "TRUNCATE ",
-            "BEGIN ", "COMMIT ", "ROLLBACK ", "SAVEPOINT ", "RELEASE ", "PREPARE TRANSACTION ", "GRANT ", "REVOKE ",
-            "LOCK ", "ANALYZE ", "EXPLAIN ", "DISCARD ", "SET ", "RESET ", "SHOW ", "VACUUM ", "CHECKPOINT ",
-            "CLUSTER ", "REINDEX ", "LISTEN ", "NOTIFY ", "UNLISTEN ", "DO "
-        ]
-        
-        # Pattern that matches any of these keywords
-        pattern = re.compile(r'\b(' + '|'.join(sql_keywords) + r')\b', re.IGNORECASE)
-        
-        match = pattern.search(string)
-        
-        return True if match else False
-    
     def filter_query_php(self, string, table_number, placeholder_number):
         # Filters queries 
 
@@ -766,34 +1025,96 @@ class PHPExtractor(Extractor):
         # : is not used in Postgres
         string = string.replace(":", "")
 
-        # Replace variables
-        pattern = r'((\{|\$)[^\s,\'\"]+)' # {variables} or $variables in the string!
-    
-        matches = re.findall(pattern, string)
-        for match in matches:
-            string = string.replace(match[0], f"placeholder{placeholder_number}")
+        # Replace variables in one pass. Every occurrence of a variable gets
+        # the same placeholder, but each one uses up a number.
+        placeholder_by_variable: dict[str, str] = {}
+        def replace_variable(match: re.Match) -> str:
+            nonlocal placeholder_number
+            placeholder: str = placeholder_by_variable.setdefault(match.group(), f"placeholder{placeholder_number}")
             placeholder_number += 1
+            return placeholder
+
+        string = _PHP_VARIABLE_PATTERN.sub(replace_variable, string)
         
-        # Replace %d
-        pattern = r'%d'
-        matches = re.findall(pattern, string)
-        for match in matches:
-            string = string.replace(match, f"placeholder_digit{placeholder_number}")
-            placeholder_number += 1
+        # Replace %d. Every occurrence gets the same placeholder, but each
+        # one uses up a number.
+        matches_count: int = string.count("%d")
+        if matches_count > 0:
+            string = string.replace("%d", f"placeholder_digit{placeholder_number}")
+            placeholder_number += matches_count
         
         # Replace %s
-        pattern = r'%s'
-        matches = re.findall(pattern, string)
-        for match in matches:
-            string = string.replace(match, f"'placeholder_string{placeholder_number}'")
-            placeholder_number += 1
+        matches_count = string.count("%s")
+        if matches_count > 0:
+            string = string.replace("%s", f"'placeholder_string{placeholder_number}'")
+            placeholder_number += matches_count
 
         # Removing '' from table names (Doesn't work in postgres)
-        pattern = r"(?<=FROM\s)'(\w+)'|(?<=JOIN\s)'(\w+)'|(?<=INTO\s)'(\w+)'|(?<=UPDATE\s)'(\w+)'|(?<=TABLE\s)'(\w+)'|(?<=TABLE IF EXISTS\s)'(\w+)'(?<=DROP\s)'(\w+)'|(?<=FROM\s)'\s(\w+)\s'|(?<=JOIN\s)'\s(\w+)\s'|(?<=INTO\s)'\s(\w+)\s'|(?<=UPDATE\s)'\s(\w+)\s'|(?<=TABLE\s)'\s(\w+)\s'|(?<=TABLE IF EXISTS\s)'\s(\w+)\s'(?<=DROP\s)'\s(\w+)\s'"
-        def replacequote(match):
-            return match.group(0).replace("'", "")
+        if "'" in string:
+            string = _PHP_QUOTED_TABLE_PATTERN.sub(r"\1\2\3", string)
+
 
-        string = re.sub(pattern, replacequote, string, flags=re.IGNORECASE)
+        return string
 
 
-        return string
\ No newline at end of file
+_EXTRACTOR_BY_EXTENSION: dict[str, type[Extractor]] = {
+    ".py": PythonExtractor,
+    ".js": JavaScriptExtractor,
+    ".php": PHPExtractor,
+}
+"""The extractor to use for each (lowercase) file extension"""
+
+_EXTRACTED_CACHE_SIZE: int = 4096
+"""The most files whose extracted strings are remembered by `_extract_one()`"""
+_extracted_by_digest: dict[tuple[type[Extractor], bytes], list[str]] = {}
+"""The strings extracted from recently seen files, keyed by extractor and SHA-1 of the content"""
+
+
+def _extract_one(record: tuple[str, str, str]) -> list[str]:
+    """
+    Extracts the strings from a single file for `extract_many()`. Run in
+    the worker processes.
+
+    Repositories are often mirrored, so the same file shows up many times.
+    Files with the same content are only extracted once per worker.
+
+    :param record: The repository name, path, and content of the file
+    :return: The strings found, or an empty list if the file is not a
+    supported type or could not be parsed.
+    """
+    repo_name, path, content = record
+    extractor_class: typing.Optional[type[Extractor]] = _EXTRACTOR_BY_EXTENSION.get(_file_extension(path))
+    if extractor_class is None or _SQL_KEYWORD_PATTERN.search(content) is None:
+        return []
+    key: tuple[type[Extractor], bytes] = (
+        extractor_class,
+        hashlib.sha1(content.encode("utf-8", "surrogatepass")).digest()
+    )
+    strings: typing.Optional[list[str]] = _extracted_by_digest.get(key)
+    if strings is None:
+        try:
+            strings = extractor_class(content).extract_strings()
+        except ParsingError:
+            strings = []
+        if len(_extracted_by_digest) >= _EXTRACTED_CACHE_SIZE:
+            _extracted_by_digest.clear()
+        _extracted_by_digest[key] = strings
+    return strings
+
+
+def extract_many(records: typing.Iterable[tuple[str, str, str]], workers: typing.Optional[int] = None,
+                 chunksize: int = 64) -> typing.Iterator[list[str]]:
+    """
+    Extracts strings from many BigQuery files in parallel, using a pool of
+    worker processes.
+
+    :param records: The repository name, path, and content of each file
+    :param workers: The number of worker processes. Defaults to the number
+    of CPUs.
+    :param chunksize: The number of files sent to a worker at a time
+    :return: The strings found in each file, in the same order as
+    `records`. Files that are not a supported type or could not be parsed
+    give an empty list.
+    """
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(_extract_one, records, chunksize=chunksize)
@@ -1,14 +1,213 @@
+import functools
+import re
 import sqlite3
 import psycopg2 
 import sys
+import threading
+import typing
+
+_UNHELPFUL_QUERY: re.Pattern = re.compile(r"\s*(?:--|/\*|#)|[\s;]*\Z")
+"""
+Matches strings that, while possibly valid SQL, are not helpful for the
+purposes of this project: ones that start with a comment, and ones that
+are empty or only semicolons.
+"""
+_SQLITE_STATEMENT_KEYWORDS: tuple[str, ...] = (
+    "ALTER", "ANALYZE", "ATTACH", "BEGIN", "COMMIT", "CREATE", "DELETE", "DETACH", "DROP", "END",
+    "EXPLAIN", "INSERT", "PRAGMA", "REINDEX", "RELEASE", "REPLACE", "ROLLBACK", "SAVEPOINT",
+    "SELECT", "UPDATE", "VACUUM", "VALUES", "WITH"
+)
+"""Keywords that can start a statement in SQLite"""
+_SQLITE_STATEMENT_START: re.Pattern = re.compile(
+    "[\\s;\ufeff]*(?:(?:" + "|".join(_SQLITE_STATEMENT_KEYWORDS) + r")\b|--|/\*|\Z)", re.IGNORECASE)
+"""
+Matches the start of anything SQLite might accept: a statement keyword
+after any whitespace, byte order marks and empty statements, or something
+only SQLite can judge (a comment, or nothing else at all).
+"""
+_POSTGRES_STATEMENT_KEYWORDS: tuple[str, ...] = (
+    "ABORT", "ALTER", "ANALYSE", "ANALYZE", "BEGIN", "CALL", "CHECKPOINT", "CLOSE", "CLUSTER",
+    "COMMENT", "COMMIT", "COPY", "CREATE", "DEALLOCATE", "DECLARE", "DELETE", "DISCARD", "DO", "DROP",
+    "END", "EXECUTE", "EXPLAIN", "FETCH", "GRANT", "IMPORT", "INSERT", "LISTEN", "LOAD", "LOCK",
+    "MERGE", "MOVE", "NOTIFY", "PREPARE", "REASSIGN", "REFRESH", "REINDEX", "RELEASE", "RESET",
+    "REVOKE", "ROLLBACK", "SAVEPOINT", "SECURITY", "SELECT", "SET", "SHOW", "START", "TABLE",
+    "TRUNCATE", "UNLISTEN", "UPDATE", "VACUUM", "VALUES", "WITH"
+)
+"""Keywords that can start a statement in PostgreSQL"""
+_POSTGRES_STATEMENT_START: re.Pattern = re.compile(
+    r"[\s;]*(?:(?:" + "|".join(_POSTGRES_STATEMENT_KEYWORDS) + r")\b|\(|--|/\*|\x00|\Z)", re.IGNORECASE)
+"""
+Matches the start of anything `pglast` might accept: a statement keyword or
+a parenthesized query after any whitespace and empty statements, or
+something only `pglast` can judge (a comment, a null character, which ends
+the query as far as PostgreSQL's parser is concerned, or nothing at all).
+"""
+_SQLITE_UNWANTED_QUERIES: frozenset[str] = frozenset(("end", "vacuum", "begin", "rollback", "rollback;"))
+"""Lowercase queries that might mess with the SQLite database"""
+_SQLITE_UNWANTED_QUERY_LENGTH: int = max(len(query) for query in _SQLITE_UNWANTED_QUERIES)
+"""
+The length of the longest of `_SQLITE_UNWANTED_QUERIES`. Lowercasing
+never shortens a string, so no longer query can match.
+"""
+_SQLITE_UNWANTED_PREFIXES: frozenset[str] = frozenset(("vacuum", "commit"))
+"""Lowercase six-character beginnings of queries that might mess with the SQLite database"""
+_SQLITE_INVALID_ERRORS: tuple[str, ...] = (
+    "syntax error",
+    # Not valid SQL
+    "unrecognized token",
+    "incomplete input",
+    # TODO Mark as False in the future once you implement concat
+    "no such function",
+    # TODO Mark as False in the future once you implement concat
+    "no tables specified",
+    # This is valid SQL in other dialects, but not in SQLite.
+    "unknown table option",
+)
+"""Parts of SQLite error messages that mean the SQL query is not valid"""
+_SQLITE_VALID_ERRORS: tuple[str, ...] = (
+    "unknown database",
+    # Possibly a prepared statement/format string
+    "duplicate column name",
+    "no such collation sequence",
+    "no such table",
+    "no such database",
+    "no such index",
+    "no such module",
+    "no such trigger",
+    "no such view",
+    "no such savepoint",
+    "already exists",
+    "no such column",
+    "unable to open database",
+    # This indicates features that might be supported in future vesions of SQLite
+    "not currently supported",
+    # SQL query valid, but not allowed in current context
+    "not authorized",
+    "cannot commit - no transaction is active",
+    # SQLite may not support this join type, but other flavors might.
+    "unknown or unsupported join type",
+    "table.*may not be modified",
+    "database.*already in use",
+    # Rollback failed - probably this is a valid query.
+    "cannot rollback",
+)
+"""
+Parts of SQLite error messages that mean the SQL query is valid, but
+couldn't run against an empty database. Regular expressions.
+"""
+_SQLITE_ERROR_PATTERN: re.Pattern = re.compile(
+    "(?P<invalid>" + "|".join(re.escape(error) for error in _SQLITE_INVALID_ERRORS) + ")|" +
+    "(?P<valid>" + "|".join(_SQLITE_VALID_ERRORS) + ")",
+    re.DOTALL)
+"""Sorts SQLite error messages into ones for valid and invalid SQL queries in one search"""
+
+_SQLITE_READ_ONLY_ACTIONS: frozenset[int] = frozenset((
+    sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE
+))
+"""SQLite authorizer actions that leave the database as it was"""
+_SQLITE_KEYWORDS: tuple[str, ...] = (
+    "ABORT", "ACTION", "ADD", "AFTER", "ALL", "ALTER", "ALWAYS", "ANALYZE", "AND", "AS", "ASC",
+    "ATTACH", "AUTOINCREMENT", "BEFORE", "BEGIN", "BETWEEN", "BY", "CASCADE", "CASE", "CAST",
+    "CHECK", "COLLATE", "COLUMN", "COMMIT", "CONFLICT", "CONSTRAINT", "CREATE", "CROSS", "CURRENT",
+    "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "DATABASE", "DEFAULT", "DEFERRABLE",
+    "DEFERRED", "DELETE", "DESC", "DETACH", "DISTINCT", "DO", "DROP", "EACH", "ELSE", "END",
+    "ESCAPE", "EXCEPT", "EXCLUDE", "EXCLUSIVE", "EXISTS", "EXPLAIN", "FAIL", "FILTER", "FIRST",
+    "FOLLOWING", "FOR", "FOREIGN", "FROM", "FULL", "GENERATED", "GLOB", "GROUP", "GROUPS", "HAVING",
+    "IF", "IGNORE", "IMMEDIATE", "IN", "INDEX", "INDEXED", "INITIALLY", "INNER", "INSERT", "INSTEAD",
+    "INTERSECT", "INTO", "IS", "ISNULL", "JOIN", "KEY", "LAST", "LEFT", "LIKE", "LIMIT", "MATCH",
+    "MATERIALIZED", "NATURAL", "NO", "NOT", "NOTHING", "NOTNULL", "NULL", "NULLS", "OF", "OFFSET",
+    "ON", "OR", "ORDER", "OTHERS", "OUTER", "OVER", "PARTITION", "PLAN", "PRAGMA", "PRECEDING",
+    "PRIMARY", "QUERY", "RAISE", "RANGE", "RECURSIVE", "REFERENCES", "REGEXP", "REINDEX", "RELEASE",
+    "RENAME", "REPLACE", "RESTRICT", "RETURNING", "RIGHT", "ROLLBACK", "ROW", "ROWS", "SAVEPOINT",
+    "SELECT", "SET", "TABLE", "TEMP", "TEMPORARY", "THEN", "TIES", "TO", "TRANSACTION", "TRIGGER",
+    "UNBOUNDED", "UNION", "UNIQUE", "UPDATE", "USING", "VACUUM", "VALUES", "VIEW", "VIRTUAL", "WHEN",
+    "WHERE", "WINDOW", "WITH", "WITHOUT"
+)
+"""SQLite's keywords, which can't always be used as plain names"""
+_SQLITE_NAME: str = "(?:(?!(?:" + "|".join(
+    # Grouped by first letter, so that most names are ruled out as keywords
+    # by their first character instead of by trying every keyword
+    first + "(?:" + "|".join(keyword[1:] for keyword in _SQLITE_KEYWORDS if keyword[0] == first) + ")"
+    for first in sorted(set(keyword[0] for keyword in _SQLITE_KEYWORDS))
+) + r")\b)[a-z_][a-z0-9_]*\b)"
+"""A name that SQLite won't mistake for a keyword, as a regular expression"""
+_SQLITE_QUALIFIED_NAME: str = "(?:" + _SQLITE_NAME + r"(?:\." + _SQLITE_NAME + ")?)"
+"""A name, optionally qualified by a schema or table name, as a regular expression"""
+_SQLITE_VALUE: str = r"(?:\?|:[a-z0-9_]+|[0-9]+|'[^'\x00]*'|NULL)"
+"""A parameter or a simple literal, as a regular expression"""
+_SQLITE_SPACE: str = r"[ \t\n\f\r]"
+"""A character that SQLite treats as whitespace, as a regular expression"""
+_SQLITE_SIMPLE_STATEMENT: re.Pattern = re.compile(
+    _SQLITE_SPACE + "*(?:" +
+    "SELECT" + _SQLITE_SPACE + r"+(?:\*|" + _SQLITE_QUALIFIED_NAME +
+    "(?:" + _SQLITE_SPACE + "*," + _SQLITE_SPACE + "*" + _SQLITE_QUALIFIED_NAME + ")*)" +
+    _SQLITE_SPACE + "+FROM" + _SQLITE_SPACE + "+" + _SQLITE_QUALIFIED_NAME + "|" +
+    "INSERT" + _SQLITE_SPACE + "+INTO" + _SQLITE_SPACE + "+" + _SQLITE_QUALIFIED_NAME + _SQLITE_SPACE + "*" +
+    r"(?:\(" + _SQLITE_SPACE + "*" + _SQLITE_NAME +
+    "(?:" + _SQLITE_SPACE + "*," + _SQLITE_SPACE + "*" + _SQLITE_NAME + ")*" +
+    _SQLITE_SPACE + r"*\)" + _SQLITE_SPACE + "*)?" +
+    "VALUES" + _SQLITE_SPACE + r"*\(" + _SQLITE_SPACE + "*" + _SQLITE_VALUE +
+    "(?:" + _SQLITE_SPACE + "*," + _SQLITE_SPACE + "*" + _SQLITE_VALUE + ")*" + _SQLITE_SPACE + r"*\)" +
+    ")" + _SQLITE_SPACE + "*(?:;" + _SQLITE_SPACE + r"*)?\Z",
+    re.IGNORECASE | re.ASCII)
+"""
+Matches the simplest and most common shapes of query,
+"SELECT <columns> FROM <table>" and
+"INSERT INTO <table> [(<columns>)] VALUES (<values>)", which SQLite always
+accepts (at worst, the table doesn't exist)
+"""
+_SQLITE_EXPLAINABLE: re.Pattern = re.compile(r"[ \t\n\f\r]*(?!EXPLAIN\b)[a-z]", re.IGNORECASE)
+"""
+Matches queries that parse the same with EXPLAIN put in front of them:
+ones that start with a keyword (other than EXPLAIN itself), rather than
+with empty statements, a byte order mark or other characters that SQLite
+only treats as whitespace in some places
+"""
+_sqlite_state: threading.local = threading.local()
+"""
+This thread's SQLite database for `check_valid`, whether a query may have
+modified it, and whether the query is only being compiled by EXPLAIN
+"""
+
+def _track_modifications(action: int, arg1: typing.Optional[str], arg2: typing.Optional[str],
+                         database_name: typing.Optional[str], trigger_name: typing.Optional[str]) -> int:
+    """
+    SQLite authorizer that notes when a query might modify the database,
+    without denying anything.
+
+    Statements compiled by EXPLAIN are never run, so they only count if
+    they are pragmas, some of which take effect as they are compiled.
+    """
+    if action not in _SQLITE_READ_ONLY_ACTIONS and \
+            (not _sqlite_state.explaining or action == sqlite3.SQLITE_PRAGMA):
+        _sqlite_state.modified = True
+    return sqlite3.SQLITE_OK
+
+def _get_sqlite_connection() -> sqlite3.Connection:
+    """
+    Returns an empty in-memory SQLite database to check a query against.
+
+    Opening a database for every query is expensive, so the database is
+    reused until a query might have modified it (created a table, started
+    a transaction, changed a pragma, ...), and only then replaced.
+    """
+    connection: typing.Optional[sqlite3.Connection] = getattr(_sqlite_state, "connection", None)
+    if connection is None or _sqlite_state.modified:
+        if connection is not None:
+            connection.close()
+        connection = sqlite3.connect(":memory:")
+        connection.set_authorizer(_track_modifications)
+        _sqlite_state.connection = connection
+        _sqlite_state.modified = False
+        _sqlite_state.explaining = False
+    return connection
 
 class SqlSyntaxError(RuntimeError):
     """
     Raised when there is a syntax error with the parsed SQL
     """
-    def __init__(self) -> None:
-        pass
 
+@functools.lru_cache(maxsize=65536)
 def check_valid_pglast_postgres(sql_query: str):
     '''
     Checks if query is valid by 1. Checking it passes parsing with `pglast` (check_valid_pglast) 2. If 1 is true, executing in PostgreSQL (check_valid_postgres)
@@ -17,6 +216,10 @@ def check_valid_pglast_postgres(sql_query: str):
 
     This function exists because 1. The pglast check is too broad (returns queries that will actually fail) and 2. The PostgreSQL execution check is too time consuming to run with each string
 
+    The same string literals show up in many files, so results are cached.
+    This is safe because check_valid_postgres starts each query from an
+    empty schema.
+
     :return: True if SQL is valid, False if not
     '''
     if (check_valid_pglast(sql_query)):
@@ -32,17 +235,13 @@ def check_valid_pglast(sql_query: str) -> bool:
 
     :return: True if SQL is valid, False if not.
     """
-    if sql_query.strip() == "":
-        # Empty strings, while technically valid SQL, are not helpful for the
-        # purposes of this project.
-        return False
-    if sql_query.lstrip()[:2] in ("--", "/*") or sql_query.lstrip()[0] == "#":
-        # All-comment SQL strings are useless as well.
-        return False
-    if sql_query.replace(";", "").strip() == "":
-        # All-semicolon strings are, while technically valid SQL, not helpful either.
+    if _UNHELPFUL_QUERY.match(sql_query) is not None:
+        # Empty, all-comment and all-semicolon strings are useless.
         return False
     # TODO Filter out other statements like "begin" and "end" which are not useful
+    if _POSTGRES_STATEMENT_START.match(sql_query) is None:
+        # Most strings aren't SQL at all. Don't make pglast parse them.
+        return False
     import pglast  # type: ignore[import-untyped]
     try:
         pglast.parse_sql(sql_query)
@@ -94,112 +293,75 @@ def check_valid(sql_query: str) -> bool:
 
     :return: True if valid, False if not
     """
-    if sql_query.strip() == "":
-        # Empty strings, while technically valid SQL, are not helpful for the
-        # purposes of this project.
-        return False
-    if sql_query.lstrip()[:2] in ("--", "/*") or sql_query.lstrip()[0] == "#":
-        # All-comment SQL strings are useless as well.
-        return False
-    if sql_query.replace(";", "").strip() == "":
-        # All-semicolon strings are, while technically valid SQL, not helpful either.
-        return False
+    valid_query, unknown_error = _check_valid_sqlite(sql_query)
+    if unknown_error is not None:
+        # Report it every time, even when the verdict was cached. One write,
+        # since stderr is line buffered and print() would write twice.
+        sys.stderr.write(unknown_error + "\n")
+    return valid_query
+
+@functools.lru_cache(maxsize=65536)
+def _check_valid_sqlite(sql_query: str) -> tuple[bool, typing.Optional[str]]:
+    """
+    Does the work of `check_valid`.
+
+    The same string literals show up in many files, so results are cached.
+    This is safe because `_get_sqlite_connection` hands out a fresh database
+    whenever a query may have modified the previous one.
+
+    :return: Whether the SQL query is valid, and a message to report if
+    SQLite gave an error that we don't know what to make of
+    """
+    if _UNHELPFUL_QUERY.match(sql_query) is not None:
+        # Empty, all-comment and all-semicolon strings are useless.
+        return False, None
     # First, manually filter out commands that might mess with the SQLITE database
-    if sql_query.lower() in ("end", "vacuum", "begin", "rollback", "rollback;"):
-        return False
-    if "vacuum" == sql_query.lower()[:6]:
-        return False
-    if "commit" == sql_query.lower()[:6]:
-        return False
+    if len(sql_query) <= _SQLITE_UNWANTED_QUERY_LENGTH and sql_query.lower() in _SQLITE_UNWANTED_QUERIES:
+        return False, None
+    if sql_query[:6].lower() in _SQLITE_UNWANTED_PREFIXES:
+        return False, None
+    if _SQLITE_STATEMENT_START.match(sql_query) is None:
+        # Most strings aren't SQL at all. Don't make SQLite parse them.
+        return False, None
+    if "\x00" in sql_query:
+        # SQLite can't be given a null character. Not valid SQL
+        return False, None
+    if _SQLITE_SIMPLE_STATEMENT.match(sql_query) is not None:
+        # No need to ask SQLite about these
+        return True, None
 
-    tempdb: sqlite3.Connection = sqlite3.connect(":memory:")
+    tempdb: sqlite3.Connection = _get_sqlite_connection()
     try:
-        try:
-            tempdb.execute(sql_query)
-        except sqlite3.Warning as e:
-            if "SQL is of wrong type" in str(e):
-                print("SQL query is of wrong type: " + repr(sql_query), file=sys.stderr)
-                return False
-            if "You can only execute one statement at a time" not in str(e):
-                raise e
+        if _SQLITE_EXPLAINABLE.match(sql_query) is not None:
+            # Compiling a statement is enough to check it. EXPLAIN compiles
+            # it without running it, which leaves the database untouched.
+            _sqlite_state.explaining = True
+            try:
+                tempdb.execute("EXPLAIN " + sql_query)
+                return True, None
+            except (sqlite3.Warning, sqlite3.ProgrammingError) as e:
+                warning_message: str = str(e)
+                if "Incorrect number of bindings supplied" in warning_message:
+                    # A prepared statement. Seems to be valid SQL
+                    return True, None
+                if "You can only execute one statement at a time" not in warning_message:
+                    raise e
+            finally:
+                _sqlite_state.explaining = False
+        # More than one statement. Later statements may depend on what the
+        # earlier ones did, so they have to be run.
         tempdb.executescript(sql_query)
     except sqlite3.OperationalError as e:
-        if "syntax error" in str(e):
-            return False
-        elif "unrecognized token" in str(e):
-            # Not valid SQL
-            return False
-        elif "incomplete input" in str(e):
-            return False
-        elif "unknown database" in str(e):
-            return True
-        elif "duplicate column name" in str(e):
-            # Possibly a prepared statement/format string
-            return True
-        elif "no such collation sequence" in str(e):
-            return True
-        elif "no such table" in str(e):
-            return True
-        elif "no such database" in str(e):
-            return True
-        elif "no such index" in str(e):
-            return True
-        elif "no such module" in str(e):
-            return True
-        elif "no such trigger" in str(e):
-            return True
-        elif "no such view" in str(e):
-            return True
-        elif "no such savepoint" in str(e):
-            return True
-        elif "already exists" in str(e):
-            return True
-        elif "no such function" in str(e):
-            # TODO Mark as False in the future once you implement concat
-            return False
-        elif "no tables specified" in str(e):
-            # TODO Mark as False in the future once you implement concat
-            return False
-        elif "no such column" in str(e):
-            return True
-        elif "unable to open database" in str(e):
-            return True
-        elif "unknown table option" in str(e):
-            # This is valid SQL in other dialects, but not in SQLite.
-            return False
-        elif "not currently supported" in str(e):
-            # This indicates features that might be supported in future vesions of SQLite
-            return True
-        elif "not authorized" in str(e):
-            # SQL query valid, but not allowed in current context
-            return True
-        elif "cannot commit - no transaction is active" in str(e):
-            return True
-        elif "unknown or unsupported join type" in str(e):
-            # SQLite may not support this join type, but other flavors might.
-            return True
-        elif "table" in str(e) and "may not be modified" in str(e):
-            return True
-        elif "database" in str(e) and "already in use" in str(e):
-            return True
-        elif "cannot rollback" in str(e):
-            # Rollback failed - probably this is a valid query.
-            return True
+        error_message: str = str(e)
+        error_match: typing.Optional[re.Match] = _SQLITE_ERROR_PATTERN.search(error_message)
+        if error_match is not None:
+            return error_match.lastgroup == "valid", None
 
         # Since we've covered ~99% of cases already, we'll just return False and not bother.
-        print("Got unknown error when processing SQL query: " + str(sql_query), file=sys.stderr)
-        print("The error is \"" + str(e) + "\"", file=sys.stderr)
-        return False
+        return False, ("Got unknown error when processing SQL query: " + str(sql_query) + "\n" +
+                       "The error is \"" + error_message + "\"")
     except sqlite3.ProgrammingError as e:
-        if "contains a null character" in str(e):
-            # Not valid SQL
-            return False
-        elif "Incorrect number of bindings supplied" in str(e):
-            # Seems to be valid SQL
-            return True
-        else:
-            # Well, we weren't expecting this...
-            print("Got unknown error when processing SQL query: " + str(sql_query), file=sys.stderr)
-            print("The error is \"" + str(e) + "\"", file=sys.stderr)
-            return False
-    return True
+        # Well, we weren't expecting this...
+        return False, ("Got unknown error when processing SQL query: " + str(sql_query) + "\n" +
+                       "The error is \"" + str(e) + "\"")
+    return True, None
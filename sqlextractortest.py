@@ -1,19 +1,90 @@
+import concurrent.futures
+import hashlib
+import os
 import pathlib
+import shelve
 import sys
+import typing
 
 import sqlextractor
 
+EXTRACT_CACHE_PATH: str = ".extract_cache"
+"""
+Where the strings extracted from each unit test are cached between runs,
+so that only the tests that have changed are run again
+"""
+
+def run_unit_test(unit_test_path: str) -> list[str]:
+    """
+    Extracts the strings from a single unit test file. Run in the worker
+    processes of a ProcessPoolExecutor.
+
+    :param unit_test_path: The path of the unit test file
+    :return: The strings extracted from the file
+    """
+    unit_test_content: str = pathlib.Path(unit_test_path).read_text(encoding="utf-8", errors="replace")
+    return sqlextractor.extractor.extractor.Extractor.extract_bigquery("", os.path.basename(unit_test_path), unit_test_content)
+
+def extractor_digest() -> bytes:
+    """
+    Identifies the version of the extractor, so that cached results from
+    a different version (or a different Python, whose parser might behave
+    differently) are not used.
+    """
+    extractor_source: bytes = pathlib.Path(sqlextractor.extractor.extractor.__file__).read_bytes()
+    return hashlib.blake2b(extractor_source + sys.version.encode(), digest_size=16).digest()
+
+def unit_test_cache_key(unit_test_path: str, extractor_version: bytes) -> str:
+    """
+    Returns the key that a unit test's results are cached under.
+
+    :param unit_test_path: The path of the unit test file
+    :param extractor_version: The version of the extractor, from `extractor_digest()`
+    """
+    unit_test_hash = hashlib.blake2b(extractor_version, digest_size=16)
+    # The file name decides which extractor is used.
+    unit_test_hash.update(os.path.basename(unit_test_path).encode() + b"\0")
+    unit_test_hash.update(pathlib.Path(unit_test_path).read_bytes())
+    return unit_test_hash.hexdigest()
+
 def main(argv: list[str]) -> int:
-    unit_tests_folder: pathlib.Path = pathlib.Path("unittests")
-    for subfolder in unit_tests_folder.iterdir():
-        print("Running \"" + str(subfolder.name) + "\" tests...")
-        for unit_test in subfolder.iterdir():
-            print("Running test \"" + str(unit_test.name) + "\"...")
-            unit_test_file = open(unit_test, 'r')
-            unit_test_content: str = unit_test_file.read()
-            unit_test_file.close()
-            extracted_strings: list[str] = sqlextractor.extractor.extractor.Extractor.extract_bigquery("", unit_test.name, unit_test_content)
-            print(extracted_strings)
+    unit_tests: list[tuple[str, list[str]]] = []
+    """The name of each folder of tests, and the paths of the tests in it"""
+    # Sorted, so that the tests always run in the same order
+    with os.scandir("unittests") as subfolders:
+        for subfolder in sorted(subfolders, key=lambda entry: entry.name):
+            with os.scandir(subfolder.path) as unit_test_entries:
+                unit_tests.append((subfolder.name, sorted(unit_test.path for unit_test in unit_test_entries)))
+    extractor_version: bytes = extractor_digest()
+    # The tests are independent of each other, so run them in parallel.
+    # Only this process prints, in order, so the output doesn't interleave.
+    with shelve.open(EXTRACT_CACHE_PATH) as extract_cache, \
+            concurrent.futures.ProcessPoolExecutor() as executor:
+        results: list[list[tuple[str, typing.Union[list[str], concurrent.futures.Future]]]] = []
+        """The cache key of each test, and its cached result or the task that is running it"""
+        for _, unit_test_paths in unit_tests:
+            folder_results: list[tuple[str, typing.Union[list[str], concurrent.futures.Future]]] = []
+            for unit_test_path in unit_test_paths:
+                cache_key: str = unit_test_cache_key(unit_test_path, extractor_version)
+                if cache_key in extract_cache:
+                    folder_results.append((cache_key, extract_cache[cache_key]))
+                else:
+                    folder_results.append((cache_key, executor.submit(run_unit_test, unit_test_path)))
+            results.append(folder_results)
+        for (subfolder_name, unit_test_paths), folder_results in zip(unit_tests, results):
+            # Write each folder's report in one go rather than a line at a time
+            report_lines: list[str] = ["Running \"" + subfolder_name + "\" tests...\n"]
+            for unit_test_path, (cache_key, result) in zip(unit_test_paths, folder_results):
+                extracted_strings: list[str]
+                if isinstance(result, concurrent.futures.Future):
+                    extracted_strings = result.result()
+                    extract_cache[cache_key] = extracted_strings
+                else:
+                    extracted_strings = result
+                report_lines.append("Running test \"" + os.path.basename(unit_test_path) + "\"...\n")
+                report_lines.append(str(extracted_strings) + "\n")
+            sys.stdout.write("".join(report_lines))
+            sys.stdout.flush()
     return 0
 
 if __name__ == "__main__":